@@ -19,6 +19,7 @@ import gi
 
 gi.require_version('Gtk', '4.0')
 
+from .covers import CoverStore
 from .items import AlbumItem, TrackItem
 from gi.repository import Adw, Gtk, GLib, GObject, Gio
 
@@ -41,8 +42,22 @@ class AlbumView(Adw.BreakpointBin):
     current_album = GObject.Property(type=GObject.TYPE_PYOBJECT)
     expand_discs = GObject.Property(type=bool, default=False)
 
+    covers = CoverStore()
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # the breakpoints change the size of the cover, so the
+        # cached version that best fits it changes as well
+        self.cover_image.connect('notify::pixel-size', self._resize_cover)
+
     def update_cover(self, cover_path: str):
-        self.cover_image.set_from_file(cover_path)
+        self.cover_image.set_from_file(
+            self.covers.for_size(
+                cover_path,
+                self.cover_image.get_pixel_size(),
+                self.get_scale_factor(),
+            )
+        )
 
     def clear_all(self):
         self.track_list.remove_all()
@@ -56,9 +71,13 @@ class AlbumView(Adw.BreakpointBin):
         self.album_artist.set_text(album.albumartist)
         self.stack.set_visible_child_name('album_view')
 
+    def _resize_cover(self, *_):
+        if self.current_album:
+            self.update_cover(self.current_album.cover)
+
     def update_tracks(self, tracks: list[TrackItem]):
         current_disc, disc_row = 0, None
-        num_discs = max(track.discnumber for track in tracks)
+        num_discs = max((track.discnumber for track in tracks), default=0)
         need_discs = num_discs > 1
 
         for i, track in enumerate(tracks):
@@ -0,0 +1,120 @@
+from gi.repository import GLib
+import contextlib
+import os
+
+from .musicdb import MusicDB
+from .scan_worker import CoverPaths, cover_path
+
+# The sizes covers are displayed at, in the queue rows, the album rows and
+# the album view. Each is also cached at twice the size for HiDPI screens.
+COVER_SIZES = (32, 64, 320)
+
+# Where older versions cached covers, which are cleared out as the tracks
+# using them are synced again.
+LEGACY_DIRS = ('thumbnails', 'large')
+
+
+class CoverStore:
+    """A content-addressed cache of cover images. Images are stored under the
+    SHA-256 hash of their original data, so the same image is only resized and
+    saved once, no matter how many albums use it, and an image's cached paths
+    can be found from its hash alone.
+
+    Each cover is cached at a set of sizes, so widgets can load the smallest
+    version that is still at least as big as they display it."""
+
+    def __init__(
+        self,
+        root=f'{GLib.get_user_cache_dir()}/RecordBox',
+        sizes: tuple[int, ...] = COVER_SIZES,
+    ):
+        self.root = root
+        self.sizes = sorted({size * scale for size in sizes for scale in (1, 2)})
+
+    def path(self, digest: str, size: int) -> str:
+        return cover_path(self.root, digest, size)
+
+    def paths(self, digest: str) -> CoverPaths:
+        """Returns the paths of the smallest and largest cached versions
+        of a cover, which are what get stored as a track's thumb and cover.
+        (Other sizes are found from either of them with for_size.)"""
+        return self.path(digest, self.sizes[0]), self.path(digest, self.sizes[-1])
+
+    def for_size(self, path: str | None, size: int, scale: int = 1) -> str | None:
+        """Returns the cached version of the cover at path that best fits a widget
+        displaying it at size pixels with the given scale factor. Paths that
+        aren't in the store are returned unchanged.
+        Args:
+            path: The path of any cached version of the cover.
+            size: The size the cover is displayed at, in logical pixels.
+            scale: The scale factor of the widget displaying it.
+        """
+        if not path or os.path.dirname(os.path.dirname(path)) != (
+            f'{self.root}/covers'
+        ):
+            return path
+        digest = os.path.splitext(os.path.basename(path))[0]
+        fits = [s for s in self.sizes if s >= size * scale]
+        return self.path(digest, fits[0] if fits else self.sizes[-1])
+
+    def remove(self, digest: str):
+        for size in self.sizes:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self.path(digest, size))
+
+    def collect_garbage(self, db: MusicDB, budget: int = 0, sweep: bool = False):
+        """Deletes cached covers that no track uses anymore. With a budget,
+        they're kept for reuse (by albums that come back, like on a drive that
+        was unmounted) while the cache fits in it, and deleted least recently
+        used first once it doesn't. Covers in use are never deleted, so the
+        cache can outgrow a budget smaller than what's in use.
+        Args:
+            db: The database the covers are recorded in.
+            budget: The most bytes the cache can take up. 0 means unused
+                covers aren't kept.
+            sweep: Whether to also delete files in the cache the database
+                doesn't know about, (like covers saved by a sync that was
+                interrupted before recording them) which means walking all of
+                it. Covers left in the old layout are always cleared out.
+        """
+        evicted = db.unused_covers()
+        if budget:
+            usage = db.cover_usage()
+            total = sum(disk_size for _, disk_size in usage)
+            unused, evicted = set(evicted), []
+            for digest, disk_size in usage:
+                if total <= budget:
+                    break
+                if digest in unused:
+                    evicted.append(digest)
+                    total -= disk_size
+        db.remove_covers(evicted)
+        db.commit()
+        for digest in evicted:
+            self.remove(digest)
+        names = [n for n in LEGACY_DIRS if os.path.isdir(f'{self.root}/{n}')]
+        if sweep:
+            names.append('covers')
+        if names:
+            self._remove_strays(
+                names, db.cached_cover_digests(), db.cover_references()
+            )
+
+    def _remove_strays(
+        self, names: list[str], digests: set[str], references: set[str]
+    ):
+        """Deletes the files in the given directories of the cache that aren't
+        a recorded cover or referenced by a track. Old layout directories are
+        removed once they're empty."""
+        for name in names:
+            for root, _, files in os.walk(f'{self.root}/{name}', topdown=False):
+                for file in files:
+                    path = os.path.join(root, file)
+                    if path in references or (
+                        name == 'covers' and os.path.splitext(file)[0] in digests
+                    ):
+                        continue
+                    os.remove(path)
+                if name in LEGACY_DIRS:
+                    with contextlib.suppress(OSError):
+                        os.rmdir(root)
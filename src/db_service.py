@@ -0,0 +1,72 @@
+from gi.repository import GLib
+from concurrent.futures import Future
+from queue import Queue
+from typing import Any, Callable
+import threading
+
+from .musicdb import MusicDB
+
+Query = Callable[[MusicDB], Any]
+
+
+class DatabaseService:
+    """Runs queries against the library on a thread of its own, so the main
+    loop never waits on SQLite. The thread keeps a read-only connection open
+    for as long as the service runs, (so its page cache stays warm between
+    queries) and runs queries one at a time in the order they were made.
+
+    A query is any function taking a MusicDB, and its result comes back as a
+    Future. Callbacks passed with a query are called with its result on the
+    main loop, in the same order the queries were made."""
+
+    def __init__(self):
+        self._queue: Queue[tuple[Query, Future] | None] = Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def query(
+        self, query: Query, callback: Callable[[Any], None] | None = None
+    ) -> Future:
+        """Queues query to run on the service's thread.
+        Args:
+            query: Called with the service's connection, returning the result.
+            callback: Called on the main loop with the result. If the query
+                raised an exception, it is raised there instead.
+        """
+        future = Future()
+        if callback:
+            future.add_done_callback(
+                lambda f: GLib.idle_add(_deliver, f, callback)
+            )
+        self._queue.put((query, future))
+        return future
+
+    def close(self):
+        """Stops the thread once the queries already queued have run."""
+        self._queue.put(None)
+
+    def _run(self):
+        try:
+            db = MusicDB(read_only=True)
+        except Exception as error:
+            # Without a connection every query fails with the reason, rather
+            # than the thread exiting and leaving them waiting forever.
+            db, failure = None, error
+        while job := self._queue.get():
+            query, future = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            if db is None:
+                future.set_exception(failure)
+                continue
+            try:
+                future.set_result(query(db))
+            except BaseException as error:
+                future.set_exception(error)
+        if db is not None:
+            db.close()
+
+
+def _deliver(future: Future, callback: Callable[[Any], None]) -> bool:
+    callback(future.result())
+    return False
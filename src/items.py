@@ -16,6 +16,7 @@ class TrackItem(GObject.Object):
     length = GObject.Property(type=int)
     path = GObject.Property(type=str)
     album = GObject.Property(type=str)
+    album_id = GObject.Property(type=int)
     artists = GObject.Property(type=str)
     albumartist = GObject.Property(type=str)
 
@@ -50,9 +51,15 @@ class TrackItem(GObject.Object):
         return other and self.path == other.path
 
 
+def sort_key(track: TrackItem) -> tuple[int, int]:
+    """The order of tracks within an album."""
+    return track.discnumber, track.tracknumber
+
+
 class AlbumItem(GObject.Object):
     __gtype_name__ = 'AlbumItem'
 
+    id = GObject.Property(type=int)
     title = GObject.Property(type=str)
     albumartist = GObject.Property(type=str)
     date = GObject.Property(type=str)
@@ -61,19 +68,32 @@ class AlbumItem(GObject.Object):
     cover = GObject.Property(type=str)
 
     artists = GObject.Property(type=GObject.TYPE_PYOBJECT)
-    tracks = GObject.Property(type=GObject.TYPE_PYOBJECT)
+    num_tracks = GObject.Property(type=int)
 
     subtitle = GObject.Property(type=str)
 
+    # Albums in the library's lists are made without their tracks, (None)
+    # which are loaded for the album that's shown through its track cache.
+    _tracks: list[TrackItem] | None = None
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        self.tracks.sort(key=lambda t: (t.discnumber, t.tracknumber))
-        self.num_tracks = len(self.tracks)
-
         self.subtitle = f'{self.duration} - {self.num_tracks} Tracks'
         if self.date:
             self.subtitle += f'\n{self.date}'
 
+    @GObject.Property(type=GObject.TYPE_PYOBJECT)
+    def tracks(self) -> list[TrackItem] | None:
+        return self._tracks
+
+    @tracks.setter
+    def tracks(self, tracks: list[TrackItem] | None):
+        if tracks is None:
+            self._tracks = None
+            return
+        self._tracks = sorted(tracks, key=sort_key)
+        self.num_tracks = len(tracks)
+
     @GObject.Property(type=str)
     def markup_title(self) -> str:
         return GLib.markup_escape_text(self.title)
@@ -86,6 +106,12 @@ class AlbumItem(GObject.Object):
     def clone(self):
         return AlbumItem(**dict(self))
 
+    def with_tracks(self, tracks: list[TrackItem]):
+        """Returns a copy of the album holding the given tracks."""
+        album = self.clone()
+        album.tracks = tracks
+        return album
+
     def for_queue(self) -> dict:
         children = Gio.ListStore.new(QueueItem)
         children.splice(0, 0, [QueueItem(**dict(t)) for t in self.tracks])
@@ -99,11 +125,7 @@ class AlbumItem(GObject.Object):
         }
 
     def __eq__(self, other) -> bool:
-        return (
-            other
-            and self.title == other.title
-            and self.albumartist == other.albumartist
-        )
+        return other and self.id == other.id
 
     def __iter__(self):
         for property in self.list_properties():
@@ -127,6 +149,7 @@ class ArtistItem(GObject.Object):
         )
         self.name = GLib.markup_escape_text(name)
         self.raw_name = name
+        self.num_albums = num_albums
         self.albums = f'{num_albums} album{"s" if num_albums > 1 else ""}'
 
     # NOTE: Artists currently do not have a unique identifier. (They do in the database,
@@ -1,9 +1,14 @@
 from gi.repository import Adw, Gtk, GLib, Gio, GObject
+from typing import Callable
 import gi
 import threading
 
 from .parser import MusicParser
-from .musicdb import MusicDB
+from .musicdb import MusicDB, SearchResults
+from .db_service import DatabaseService
+from .snapshot import load_library
+from .track_cache import PREFETCH_DISTANCE, TrackCache
+from .watcher import LibraryWatcher
 from .items import AlbumItem, ArtistItem, TrackItem
 from .library_lists import AlbumList, ArtistList
 
@@ -39,12 +44,22 @@ class MusicLibrary(Adw.Bin):
     filter_all_albums = GObject.Property(type=bool, default=False)
 
     music_directory = GObject.Property(type=str, default='')
+    extra_directories = GObject.Property(type=GObject.TYPE_STRV)
+    scan_workers = GObject.Property(type=int, default=0)
+    scan_batch_size = GObject.Property(type=int, default=100)
+    cover_cache_size = GObject.Property(type=int, default=0)
+    watch_library = GObject.Property(type=bool, default=False)
 
     artist_sort = GObject.Property(type=str, default='name-descending')
     album_sort = GObject.Property(type=str, default='name-descending')
 
     close = GObject.Signal()
 
+    # Emits whenever the lists have been filled from the library. The lists
+    # are loaded in the background, so they start out empty.
+    lists_loaded = GObject.Signal()
+    loaded = GObject.Property(type=bool, default=False)
+
     # Emits when the AlbumList's selection changes.
     album_changed = GObject.Signal(arg_types=(GObject.TYPE_PYOBJECT,))
 
@@ -60,6 +75,21 @@ class MusicLibrary(Adw.Bin):
         super().__init__()
 
         self.parser = MusicParser()
+        self.watcher = LibraryWatcher()
+        self.watcher.connect('changed', self._on_library_changed)
+        # The sync's connection to the database, the only one that writes to
+        # it. Opened by the first sync, then kept for the next ones.
+        self._writer: MusicDB | None = None
+        # Everything the lists show is read through here, off the main thread.
+        self.database = DatabaseService()
+        # Albums are listed without their tracks, which are loaded into here.
+        self.tracks = TrackCache()
+        # Keeps syncs and updates from the watcher from writing at the same time.
+        self._db_lock = threading.Lock()
+        # The album last sent with album-changed, and a confirmation of the
+        # selection that's waiting for the selected album to be sent first.
+        self._delivered: AlbumItem | None = None
+        self._pending_confirm: bool | None = None
 
         self.bind_property(
             'music-directory',
@@ -67,7 +97,32 @@ class MusicLibrary(Adw.Bin):
             'path',
             GObject.BindingFlags.DEFAULT,
         )
+        self.bind_property(
+            'extra-directories',
+            self.parser,
+            'extra_paths',
+            GObject.BindingFlags.DEFAULT,
+        )
+        self.bind_property(
+            'scan-workers',
+            self.parser,
+            'workers',
+            GObject.BindingFlags.DEFAULT,
+        )
+        self.bind_property(
+            'scan-batch-size',
+            self.parser,
+            'batch_size',
+            GObject.BindingFlags.DEFAULT,
+        )
+        self.bind_property(
+            'cover-cache-size',
+            self.parser,
+            'cover_cache_size',
+            GObject.BindingFlags.DEFAULT,
+        )
 
+        self.parser.connect('batch-committed', self._on_batch_committed)
         self.parser.bind_property(
             'progress',
             self.progress_bar,
@@ -77,6 +132,10 @@ class MusicLibrary(Adw.Bin):
         self.connect(
             'notify::show-all-artists', lambda *_: self.refresh_lists()
         )
+        self.connect('notify::watch-library', lambda *_: self._update_watcher())
+        self.connect(
+            'notify::extra-directories', lambda *_: self._update_watcher()
+        )
         self.artist_list.connect(
             'activate', lambda *_: self.album_list.grab_focus()
         )
@@ -86,9 +145,10 @@ class MusicLibrary(Adw.Bin):
             self.stack.set_visible_child_name('setup')
         else:
             self.stack.set_visible_child_name('library')
+            self._update_watcher()
 
     @Gtk.Template.Callback()
-    def sync_library(self, _, show_spinner: bool = True):
+    def sync_library(self, _, show_spinner: bool = True, full: bool = False):
         if self.parser.path in ['', '-']:
             self.stack.set_visible_child_name('setup')
             return
@@ -96,25 +156,77 @@ class MusicLibrary(Adw.Bin):
         if show_spinner:
             self.stack.set_visible_child_name('sync')
             self.spinner.start()
-        self.thread = threading.Thread(target=self.update_db)
+        self.thread = threading.Thread(target=self.update_db, args=(full,))
         self.thread.daemon = True
         self.progress_bar.set_visible(True)
         self.thread.start()
 
-    def update_db(self):
-        db = MusicDB()
-        self.parser.build(db)
-        db.close()
+    def update_db(self, full: bool = False):
+        with self._db_lock:
+            self.parser.build(self._write_connection(), full)
         GLib.idle_add(self.refresh_lists)
         GLib.idle_add(self.progress_bar.set_visible, False)
         GLib.idle_add(self.spinner.stop)
+        GLib.idle_add(self._update_watcher)
 
     def refresh_lists(self):
-        db = MusicDB()
+        show_all_artists = self.show_all_artists
+        self.database.query(
+            lambda db: load_library(db, show_all_artists),
+            lambda lists: self._populate_lists(*lists),
+        )
+
+    def _populate_lists(
+        self, artists: list[ArtistItem], albums: list[AlbumItem]
+    ):
         self.stack.set_visible_child_name('library')
-        self.artist_list.populate(db.get_artists(self.show_all_artists))
-        self.album_list.populate(db.get_albums())
-        db.close()
+        self.tracks.clear()
+        self.artist_list.populate(artists)
+        self.album_list.populate(albums)
+        self.loaded = True
+        self.emit('lists-loaded')
+
+    def when_loaded(self, callback: Callable[[], None]):
+        """Calls callback once the lists have been filled for the first
+        time, or straight away if they already have been."""
+        if self.loaded:
+            callback()
+            return
+
+        def loaded(*_):
+            self.disconnect(handler)
+            callback()
+
+        handler = self.connect('lists-loaded', loaded)
+
+    def update_lists(
+        self,
+        ids: set[int],
+        albums: list[AlbumItem],
+        artists: list[ArtistItem],
+    ):
+        """Updates the lists in place after part of the library was synced.
+        Args:
+            ids: The ids of the albums that were changed or removed.
+            albums: The current versions of those albums.
+            artists: All the artists currently in the library.
+        """
+        self.tracks.discard(ids)
+        self.album_list.update(albums, lambda a: a.id in ids)
+
+        # Only artists that are new, gone or have a different number of
+        # albums are touched, so the selection isn't lost needlessly.
+        current = {(a.raw_name, a.albums) for a in self.artist_list.model}
+        fresh = {(a.raw_name, a.albums) for a in artists}
+        self.artist_list.update(
+            [a for a in artists if (a.raw_name, a.albums) not in current],
+            lambda a: (a.raw_name, a.albums) not in fresh,
+        )
+
+    def shutdown(self):
+        """Stops the library's database service, once the queries already
+        queued have run. Called when the application shuts down."""
+        self.database.close()
 
     def filter_all(self, *_):
         self.album_list.filter_all()
@@ -154,14 +266,37 @@ class MusicLibrary(Adw.Bin):
 
     @Gtk.Template.Callback()
     def _album_selection_changed(self, _, selected: AlbumItem):
-        self.emit('album-changed', selected)
         self.set_property('filter-all-albums', False)
+        self._pending_confirm = None
+        # Queued first, so the selected album is usually loaded along with
+        # its neighbours by the time it's looked for.
+        self._prefetch_tracks()
+        self.load_album(selected, self._emit_album_changed)
+
+    def _emit_album_changed(self, album: AlbumItem):
+        # the selection may have moved on while the album was loading
+        if album == self.album_list.selection_model.get_selected_item():
+            self.emit('album-changed', album)
+            self._delivered = album
+            if (activated := self._pending_confirm) is not None:
+                self._pending_confirm = None
+                self._emit_confirmed(activated)
 
     @Gtk.Template.Callback()
     def _album_confirmed(self, _, activated: bool = False):
-        """Callback for the AlbumList's selection_confirmed signal, emits a different
-        signal depending on whether the library sidebar is collapsed or not.
-        """
+        """Callback for the AlbumList's selection_confirmed signal. The
+        selected album's tracks are loaded in the background, so if it hasn't
+        been sent with album-changed yet, the confirmation waits until it has,
+        so that it doesn't act on the album shown before."""
+        selected = self.album_list.selection_model.get_selected_item()
+        if selected and selected != self._delivered:
+            self._pending_confirm = activated
+        else:
+            self._emit_confirmed(activated)
+
+    def _emit_confirmed(self, activated: bool):
+        """Emits a different signal depending on whether the library sidebar
+        is collapsed or not."""
         if self.parent_collapsed:
             # When the sidebar is collapsed, the album_confirmed signal is emitted to indicate that
             # the user explicitly selected an album with a click rather than selecting it through keynav, so the library
@@ -173,6 +308,117 @@ class MusicLibrary(Adw.Bin):
             # clicks to change the selection without starting playback.
             self.emit('album-activated')
 
+    def load_album(
+        self, album: AlbumItem, callback: Callable[[AlbumItem], None]
+    ):
+        """Calls callback on the main loop with a copy of album holding its
+        tracks, once they're loaded. If the album no longer has any, (it was
+        removed by a sync since it was listed) callback isn't called."""
+        if tracks := self.tracks.get(album.id):
+            callback(album.with_tracks(tracks))
+            return
+        self.database.query(
+            lambda db: self._load_tracks(db, album.id),
+            lambda tracks: tracks and callback(album.with_tracks(tracks)),
+        )
+
+    def _load_tracks(self, db: MusicDB, album: int) -> list[TrackItem] | None:
+        # Runs on the database service's thread, after any prefetch queued
+        # before it, so the album may have been loaded since it was missed.
+        if (tracks := self.tracks.get(album)) is None:
+            loaded = db.get_album_tracks({album})
+            tracks = self.tracks.add(loaded, [album]).get(album)
+        return tracks
+
+    def _prefetch_tracks(self):
+        """Loads the tracks of the albums around the selection in the
+        background, so changing the selection rarely waits on the database."""
+        around = self.album_list.around_selection(PREFETCH_DISTANCE)
+        albums = [album.id for album in around]
+        if not (missing := self.tracks.touch(albums)):
+            return
+        order = [album for album in albums if album in missing]
+        self.database.query(
+            lambda db: self.tracks.add(db.get_album_tracks(missing), order)
+        )
+
+    def _on_batch_committed(self, _, ids: set[int]):
+        # Runs on the sync thread, which carries on while the batch is read.
+        show_all_artists = self.show_all_artists
+        self.database.query(
+            lambda db: (db.get_albums(ids), db.get_artists(show_all_artists)),
+            lambda lists: self._show_batch(ids, *lists),
+        )
+
+    def _show_batch(
+        self,
+        ids: set[int],
+        albums: list[AlbumItem],
+        artists: list[ArtistItem],
+    ):
+        # the sync page is swapped out as soon as there is something to show
+        self.stack.set_visible_child_name('library')
+        self.update_lists(ids, albums, artists)
+
+    def _update_watcher(self):
+        if self.watch_library and self.parser.path not in ['', '-']:
+            self.watcher.start(self.parser.roots())
+        else:
+            self.watcher.stop()
+
+    def _on_library_changed(self, _, directories: list[str]):
+        threading.Thread(
+            target=self._update_directories, args=(directories,), daemon=True
+        ).start()
+
+    def _update_directories(self, directories: list[str]):
+        with self._db_lock:
+            db = self._write_connection()
+            ids = self.parser.update_directories(db, directories)
+            albums = db.get_albums(ids)
+            artists = db.get_artists(self.show_all_artists)
+        GLib.idle_add(self.update_lists, ids, albums, artists)
+
+    def _write_connection(self) -> MusicDB:
+        # must be called with the _db_lock held
+        if not self._writer:
+            self._writer = MusicDB()
+        return self._writer
+
+    @Gtk.Template.Callback()
+    def _on_search_changed(self, entry: Gtk.SearchEntry):
+        if not (query := entry.get_text().strip()):
+            self.filter_all()
+            self.artist_list.filter_all()
+            return
+        self.database.query(
+            lambda db: db.search(query),
+            lambda results: self._show_search_results(entry, query, results),
+        )
+
+    def _show_search_results(
+        self, entry: Gtk.SearchEntry, query: str, results: SearchResults
+    ):
+        # results of a search that has since been changed are dropped
+        if entry.get_text().strip() != query:
+            return
+        # albums show up for their own title, their tracks' titles or their artists
+        albums = {a.id for a in results.albums} | {
+            t.album_id for t in results.tracks
+        }
+        artists = {a.raw_name for a in results.artists}
+        self.artist_list.unselect_all()
+        self.artist_list.filter_on(lambda a: a.raw_name in artists)
+        self.album_list.filter_on(
+            lambda a: a.id in albums or not artists.isdisjoint(a.artists)
+        )
+        self.album_list_page.set_title(f'Albums - {query}')
+        self.set_property('filter-all-albums', False)
+
+    @Gtk.Template.Callback()
+    def _on_stop_search(self, entry: Gtk.SearchEntry):
+        entry.set_text('')
+
     @Gtk.Template.Callback()
     def _on_artist_return(self, _):
         self.inner_split.set_show_content('album_view')
@@ -1,6 +1,8 @@
 from gi.repository import Adw, Gtk, GLib, GObject, Gio
+from .covers import CoverStore
 from .items import AlbumItem, ArtistItem, TrackItem
 from enum import StrEnum
+from typing import Callable
 
 
 class ArtistSort(StrEnum):
@@ -66,6 +68,22 @@ class LibraryList(Gtk.ListView):
         self._update_sort()
         self.scroll_to(0, Gtk.ListScrollFlags.FOCUS)
 
+    def update(
+        self,
+        items: list[GObject.Object],
+        stale: Callable[[GObject.Object], bool],
+    ):
+        """Updates the list in place rather than repopulating it.
+        Args:
+            items: Items to add to the list.
+            stale: Returns True for existing items that should be removed.
+        """
+        for i in reversed(range(len(self.model))):
+            if stale(self.model[i]):
+                self.model.remove(i)
+        self.model.splice(len(self.model), 0, items)
+        self._update_sort()
+
     def unselect_all(self):
         # for some reason unselect_all() doesn't work on a SingleSelection
         self.selection_model.unselect_item(self.selection_model.get_selected())
@@ -74,13 +92,21 @@ class LibraryList(Gtk.ListView):
         self.model.remove_all()
 
     def get_row_at_index(self, index: int) -> GObject.Object:
-        return self.model[index]
+        return self.filter_model[index]
 
     def select_index(self, index: int):
         self.selection_model.select_item(index, True)
 
+    def filter_all(self):
+        self.filter_model.set_filter(None)
+
+    def filter_on(self, matches: Callable[[GObject.Object], bool]):
+        """Shows only the items matches returns True for."""
+        self.filter_model.set_filter(Gtk.CustomFilter.new(matches))
+
     def _setup_model(self):
-        self.selection_model = Gtk.SingleSelection.new(self.model)
+        self.filter_model = Gtk.FilterListModel.new(self.model, None)
+        self.selection_model = Gtk.SingleSelection.new(self.filter_model)
         self.selection_model.set_can_unselect(True)
         self.selection_model.set_autoselect(False)
         self.selection_model.connect('selection_changed', self._item_selected)
@@ -104,7 +130,7 @@ class ArtistList(LibraryList):
 
     def scroll_to_row_with_name(self, name: str):
         name = GLib.markup_escape_text(name)
-        for i, row in enumerate(self.model):
+        for i, row in enumerate(self.filter_model):
             if row.name == name:
                 self.scroll_to(i, Gtk.ListScrollFlags.SELECT)
                 break
@@ -125,26 +151,56 @@ class AlbumList(LibraryList):
 
     sort = GObject.Property(type=str, default=AlbumSort.DATE_DESC)
 
+    covers = CoverStore()
+
     def __init__(self):
 
         # In the case of the AlbumList the click shouldn't count as an acvtivation,
         # because playback will start when activation is true.
         super().__init__(click_activates=False)
+        # the albums in the list by id, for looking up a track's album
+        self._albums: dict[int, AlbumItem] = {}
 
-    def get_row_at_index(self, index: int):
-        return self.filter_model[index]
+    def populate(self, items: list[AlbumItem]):
+        super().populate(self._fit_thumbs(items))
+        self._albums = {album.id: album for album in self.model}
 
-    def filter_all(self):
-        self.filter_model.set_filter(None)
+    def update(
+        self, items: list[AlbumItem], stale: Callable[[AlbumItem], bool]
+    ):
+        super().update(self._fit_thumbs(items), stale)
+        self._albums = {album.id: album for album in self.model}
 
     def filter_on_artist(self, artist: str):
-        self.filter_model.set_filter(
-            Gtk.CustomFilter.new(lambda r: artist in r.artists)
-        )
+        self.filter_on(lambda r: artist in r.artists)
         self._item_selected()
 
     def find_album_by_track(self, track: TrackItem) -> AlbumItem | None:
-        return next((row for row in self.model if track in row.tracks), None)
+        # Albums are listed without their tracks, so the album's title and
+        # artist are checked instead. (Tracks restored from a saved queue
+        # may have an outdated album id.)
+        album = self._albums.get(track.album_id)
+        if album and (album.albumartist, album.title) == (
+            track.albumartist,
+            track.album,
+        ):
+            return album
+        return self.find_album(track.albumartist, track.album)
+
+    def around_selection(self, distance: int) -> list[AlbumItem]:
+        """Returns the selected album and the albums up to distance rows
+        away from it, as the list is currently shown, furthest first."""
+        selected = self.selection_model.get_selected()
+        if selected == Gtk.INVALID_LIST_POSITION:
+            return []
+        rows = range(
+            max(selected - distance, 0),
+            min(selected + distance + 1, len(self.filter_model)),
+        )
+        return [
+            self.filter_model[i]
+            for i in sorted(rows, key=lambda i: -abs(i - selected))
+        ]
 
     def find_album(self, albumartist: str, title: str) -> AlbumItem | None:
         return next(
@@ -162,15 +218,14 @@ class AlbumList(LibraryList):
                 self.scroll_to(i, Gtk.ListScrollFlags.SELECT)
                 break
 
-    def _setup_model(self):
-        self.filter_model = Gtk.FilterListModel.new(self.model, None)
-        self.selection_model = Gtk.SingleSelection.new(self.filter_model)
-        self.selection_model.set_can_unselect(True)
-        self.selection_model.set_autoselect(False)
-        self.selection_model.connect(
-            'selection_changed', lambda *_: self._item_selected()
-        )
-        self.set_model(self.selection_model)
+    def _fit_thumbs(self, items: list[AlbumItem]) -> list[AlbumItem]:
+        """Points the albums' thumbnails at the cached size that fits the rows.
+        (The row template binds the thumb directly, so it's done here.)"""
+        for item in items:
+            item.thumb = self.covers.for_size(
+                item.thumb, 64, self.get_scale_factor()
+            )
+        return items
 
     def _update_sort(self):
         match AlbumSort(self.sort):
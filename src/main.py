@@ -29,6 +29,7 @@ from .window import RecordBoxWindow
 from .preferences import RecordBoxPreferencesWindow
 from .mpris import MPRIS
 from .player import Player
+from .scan_stats import format_runs
 
 
 class RecordBoxApplication(Adw.Application):
@@ -54,12 +55,16 @@ class RecordBoxApplication(Adw.Application):
             'preferences', self.on_preferences_action, ['<control>comma']
         )
         self.create_action('refresh', self.on_refresh_action, ['<control>r'])
+        self.create_action(
+            'scan-report', self.on_scan_report_action, ['<control><shift>d']
+        )
 
         self.player = Player()
         MPRIS(self)
         self.settings = Gio.Settings.new('com.github.edestcroix.RecordBox')
 
         self.connect('shutdown', self._save_state)
+        self.connect('shutdown', self._close_library)
 
     def do_activate(self):
         """Called when the application is activated.
@@ -103,7 +108,17 @@ class RecordBoxApplication(Adw.Application):
         preferences.present()
 
     def on_refresh_action(self, *_):
-        self.props.active_window.library.sync_library(_)
+        # A manual refresh checks every file, to catch files that were
+        # modified in place without changing their directory.
+        self.props.active_window.library.sync_library(_, full=True)
+
+    def on_scan_report_action(self, *_):
+        """Callback for the app.scan-report action, a debugging aid that
+        prints the metrics of the most recent syncs."""
+        self.props.active_window.library.database.query(
+            lambda db: db.scan_runs(),
+            lambda runs: print(format_runs(runs)),
+        )
 
     def create_action(self, name, callback, shortcuts=None):
         """Add an application action.
@@ -148,6 +163,10 @@ class RecordBoxApplication(Adw.Application):
         ):
             win.save_state()
 
+    def _close_library(self, *_):
+        if win := self.props.active_window:
+            win.library.shutdown()
+
 
 def main(version, app_id):
     """The application's entry point."""
@@ -1,98 +1,422 @@
 from gi.repository import GLib
 import os
 import sqlite3
+import time
 from collections import namedtuple
 
 from .items import TrackItem, AlbumItem, ArtistItem
+from .scan_worker import CachedCover, FileStat, TrackTags
 
-
-ArtistTags = namedtuple('ArtistTags', ['name', 'sort', 'path'])
-TrackTags = namedtuple(
-    'TrackTags',
-    [
-        'title',
-        'track',
-        'disc',
-        'discsubtitle',
-        'album',
-        'albumartist',
-        'date',
-        'length',
-        'thumb',
-        'cover',
-        'path',
-        'modified',
-        'artists',
-    ],
+# A directory's modification time, number of entries and a fingerprint of
+# their names, used to skip directories that haven't changed since a sync.
+DirectoryState = namedtuple(
+    'DirectoryState', ['mtime', 'entries', 'fingerprint']
 )
 
+# Results of a search of the library, each list ordered from best to worst match.
+SearchResults = namedtuple('SearchResults', ['albums', 'artists', 'tracks'])
+
+# The most matches of each kind that a search ranks when every word in it is
+# shorter than SHORT_PREFIX. Ranking is what takes the time when a prefix of
+# a letter or two matches a large part of the library, so past this, matches
+# are left out before they are ranked. Longer words are all ranked.
+SEARCH_CANDIDATES = 2000
+SHORT_PREFIX = 3
+
+# Page cache sizes, in KiB. The writer gets the bigger one, since a sync
+# looks up every directory and file it checks.
+WRITER_CACHE_SIZE = 32768
+READER_CACHE_SIZE = 8192
+
+# How big the write-ahead log is allowed to stay after a checkpoint, in bytes.
+WAL_SIZE_LIMIT = 64 * 1024 * 1024
+
+# How long a connection waits for another one's lock, in milliseconds. The
+# first is sqlite3's default, the second is used while migrating, since a
+# connection may have to wait for another one to run the migrations.
+BUSY_TIMEOUT = 5000
+MIGRATION_BUSY_TIMEOUT = 10 * 60 * 1000
+
 
 class MusicDB:
+    """A connection to the library database. The database runs in WAL mode, so
+    readers never block on the writer or the other way around: the scanner
+    keeps one writer connection, and everything that only reads the library,
+    (like the UI) opens a read-only connection with read_only=True, which sees
+    the library as of the writer's last commit.
+
+    Connections can be handed between threads, but must only be used by one
+    thread at a time."""
+
     def __init__(
-        self, path=f'{GLib.get_user_data_dir()}/RecordBox/recordbox.db'
+        self,
+        path=f'{GLib.get_user_data_dir()}/RecordBox/recordbox.db',
+        read_only: bool = False,
     ):
-        if first_start := not os.path.exists(path):
-            os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
         self.path = path
-        self.db = sqlite3.connect(self.path)
+        self.read_only = read_only
+        # whether what the library shows was changed since the last commit
+        self._changed = False
+        if read_only and self._needs_migration():
+            # the schema can only be created or upgraded by a writer
+            MusicDB(path).close()
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
         self.db.row_factory = sqlite3.Row
         self.cursor = self.db.cursor()
-        if first_start:
-            self._create_tables()
-            self._create_views()
-
-    def insert_track(self, track: TrackTags):
-        self.cursor.execute(
-            'INSERT INTO tracks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
-            track[:12],
-        )
-
-        # Albums switching between Various Artists and a single artist
-        # need to be updated manually here to make sure all tracks in the album
-        # get the change propagated. (E.g if no tracks have an albumartist tag an
-        # the artist tag is deleted from a track, it becomes a Various Artists album,
-        # but only one track was modified, so the Parser will only change that one track. Without
-        # this update here, the rest of the tracks will still show up under the previous albumartist.)
-        if albumartist := track[5]:
-            if albumartist == '[Various Artists]':
-                self.cursor.execute(
-                    'UPDATE tracks SET albumartist = ? WHERE album = ? AND date = ?',
-                    (albumartist, track[4], track[6]),
-                )
-            else:
-                self.cursor.execute(
-                    'UPDATE tracks SET albumartist = ? WHERE albumartist = "[Various Artists]" AND album = ? AND date = ?',
-                    (albumartist, track[4], track[6]),
+        if read_only:
+            self.cursor.execute('PRAGMA query_only = ON')
+            self.cursor.execute(f'PRAGMA cache_size = -{READER_CACHE_SIZE}')
+            return
+        self.cursor.execute(f'PRAGMA busy_timeout = {MIGRATION_BUSY_TIMEOUT}')
+        # WAL mode is stored in the database file, so this only has to be done
+        # by the writer. Syncing to disk only on checkpoints is safe in WAL mode,
+        # a crash can lose the last commits but not corrupt the database.
+        self.cursor.execute('PRAGMA journal_mode = WAL')
+        self.cursor.execute('PRAGMA synchronous = NORMAL')
+        self.cursor.execute(f'PRAGMA cache_size = -{WRITER_CACHE_SIZE}')
+        self.cursor.execute(f'PRAGMA journal_size_limit = {WAL_SIZE_LIMIT}')
+        # needed for removing a track to remove its artists
+        self.cursor.execute('PRAGMA foreign_keys = ON')
+        self._migrate()
+        self.cursor.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT}')
+
+    def insert_album(self, tracks: list[TrackTags]) -> set[int]:
+        """Inserts or updates tracks along with their albums and artists, in a
+        few statements for all of them rather than several per track. Meant
+        for the tracks of a directory, which are usually a single album.
+        Returns the ids of the albums that were changed by them."""
+        if not tracks:
+            return set()
+        self._changed = True
+        tracks = [
+            t._replace(albumartist=t.albumartist or 'Unknown Artist')
+            for t in tracks
+        ]
+        # an artist's sort name replaces the stored one, if it has one
+        sorts: dict[str, str | None] = {}
+        for track in tracks:
+            sorts.setdefault(track.albumartist, None)
+            for artist in track.artists:
+                if artist.sort or artist.name not in sorts:
+                    sorts[artist.name] = artist.sort
+        self.cursor.executemany(
+            """INSERT INTO artists (name, sort) VALUES (?, ?)
+                ON CONFLICT (name) DO UPDATE SET sort = coalesce(excluded.sort, sort)""",
+            sorts.items(),
+        )
+        artists = self._ids('artists', 'name', sorts)
+
+        albums: dict[tuple[str, str], list[TrackTags]] = {}
+        for track in tracks:
+            albums.setdefault((track.album, track.albumartist), []).append(track)
+        album_ids = {
+            (title, albumartist): self._album_id(
+                title,
+                artists[albumartist],
+                next((t.date for t in reversed(album) if t.date), None),
+            )
+            for (title, albumartist), album in albums.items()
+        }
+
+        self.cursor.executemany(
+            """INSERT INTO tracks (path, album_id, title, track, discnumber,
+                discsubtitle, length, thumb, cover, modified, size)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (path) DO UPDATE SET
+                album_id = excluded.album_id, title = excluded.title,
+                track = excluded.track, discnumber = excluded.discnumber,
+                discsubtitle = excluded.discsubtitle, length = excluded.length,
+                thumb = excluded.thumb, cover = excluded.cover,
+                modified = excluded.modified, size = excluded.size""",
+            [
+                (
+                    t.path,
+                    album_ids[t.album, t.albumartist],
+                    t.title,
+                    t.track,
+                    t.disc,
+                    t.discsubtitle,
+                    t.length,
+                    t.thumb,
+                    t.cover,
+                    t.modified,
+                    t.size,
                 )
+                for t in tracks
+            ],
+        )
+        track_ids = self._ids('tracks', 'path', [t.path for t in tracks])
 
         # Makes sure removed artists are actually removed from the database
         self.cursor.execute(
-            'DELETE FROM artists WHERE path = ?',
-            (track.path,),
+            f"DELETE FROM track_artists WHERE track_id IN ({', '.join('?' * len(track_ids))})",
+            tuple(track_ids.values()),
+        )
+        self.cursor.executemany(
+            'INSERT OR IGNORE INTO track_artists VALUES (?, ?)',
+            [
+                (track_ids[t.path], artists[artist.name])
+                for t in tracks
+                for artist in t.artists
+            ],
         )
+
+        changed = set(album_ids.values())
+        for (title, albumartist), album in albums.items():
+            for date in {t.date for t in album}:
+                changed.update(
+                    self._merge_various_artists(
+                        album_ids[title, albumartist], title, albumartist, date
+                    )
+                )
+        return changed
+
+    def _merge_various_artists(
+        self, album: int, title: str, albumartist: str, date: str | None
+    ) -> list[int]:
+        """Moves the tracks of other versions of an album to it, returning the
+        ids of the albums they were moved from.
+
+        Albums switching between Various Artists and a single artist
+        need to be updated manually here to make sure all tracks in the album
+        get the change propagated. (E.g if no tracks have an albumartist tag an
+        the artist tag is deleted from a track, it becomes a Various Artists album,
+        but only one track was modified, so the Parser will only change that one track. Without
+        this update here, the rest of the tracks will still show up under the previous albumartist.)"""
+        if albumartist == '[Various Artists]':
+            self.cursor.execute(
+                'SELECT id FROM albums WHERE title = ? AND date = ? AND id != ?',
+                (title, date, album),
+            )
+        else:
+            self.cursor.execute(
+                """SELECT albums.id FROM albums JOIN artists ON artists.id = artist_id
+                    WHERE title = ? AND date = ? AND name = '[Various Artists]'
+                    AND albums.id != ?""",
+                (title, date, album),
+            )
+        merged = [row[0] for row in self.cursor.fetchall()]
         self.cursor.executemany(
-            'INSERT INTO artists VALUES (?, ?, ?)', track[12]
+            'UPDATE tracks SET album_id = ? WHERE album_id = ?',
+            [(album, other) for other in merged],
         )
+        return merged
 
     def commit(self):
+        if self._changed:
+            self.cursor.execute('UPDATE generation SET value = value + 1')
+            self._changed = False
         self.db.commit()
 
+    def generation(self) -> int:
+        """Returns a number that changes each time a commit changes the
+        albums, artists or tracks in the library, for telling whether
+        something loaded from it earlier is still current."""
+        self.cursor.execute('SELECT value FROM generation')
+        return self.cursor.fetchone()[0]
+
     def close(self):
         self.db.close()
 
-    def remove_missing(self, root: str):
-        self.cursor.execute('SELECT path FROM tracks')
-        for path in self.cursor.fetchall():
-            if not os.path.exists(path[0]) or not path[0].startswith(root):
-                self.cursor.execute('DELETE FROM tracks WHERE path = ?', path)
-        self.db.commit()
+    def remove_outside(self, roots: list[str]):
+        """Removes tracks that aren't under any of roots,
+        along with the albums and artists left without a track."""
+        outside = ' AND '.join(['NOT (path >= ? AND path < ?)'] * len(roots))
+        self.cursor.execute(
+            f'DELETE FROM tracks WHERE {outside or 1}',
+            [bound for root in roots for bound in _subtree(root)],
+        )
+        self._changed |= self.cursor.rowcount > 0
+        self.remove_orphans()
+        self.commit()
+
+    def remove_orphans(self):
+        """Removes albums without tracks, then artists that aren't
+        the artist of a track or the album artist of an album."""
+        for query in (
+            """DELETE FROM albums WHERE NOT EXISTS
+                (SELECT 1 FROM tracks WHERE album_id = albums.id)""",
+            """DELETE FROM artists WHERE NOT EXISTS
+                (SELECT 1 FROM track_artists WHERE artist_id = artists.id)
+                AND NOT EXISTS (SELECT 1 FROM albums WHERE artist_id = artists.id)""",
+        ):
+            self.cursor.execute(query)
+            self._changed |= self.cursor.rowcount > 0
+
+    def file_stats(self, root: str) -> dict[str, FileStat]:
+        """Returns the stored modification time and size of every track
+        under root, keyed by path, so that files on disk can be checked for
+        changes without querying the database for each one."""
+        self.cursor.execute(
+            'SELECT path, modified, size FROM tracks WHERE path >= ? AND path < ?',
+            _subtree(root),
+        )
+        return {path: (modified, size) for path, modified, size in self.cursor}
+
+    def directory_states(self, root: str) -> dict[str, DirectoryState]:
+        """Returns the stored states of root and every directory under it."""
+        self.cursor.execute(
+            """SELECT path, mtime, entries, fingerprint FROM directories
+                WHERE path = ? OR (path >= ? AND path < ?)""",
+            (root, *_subtree(root)),
+        )
+        return {
+            path: DirectoryState(*state) for path, *state in self.cursor
+        }
+
+    def album_ids(self, root: str) -> set[int]:
+        """Returns the ids of albums with tracks under root."""
+        self.cursor.execute(
+            'SELECT DISTINCT album_id FROM tracks WHERE path >= ? AND path < ?',
+            _subtree(root),
+        )
+        return {album[0] for album in self.cursor}
+
+    def remove_tracks(self, paths: list[str]):
+        self.cursor.executemany(
+            'DELETE FROM tracks WHERE path = ?', [(p,) for p in paths]
+        )
+        self._changed |= self.cursor.rowcount > 0
+
+    def update_directory(self, path: str, state: DirectoryState, scan: int = 0):
+        self.cursor.execute(
+            'INSERT INTO directories VALUES (?, ?, ?, ?, ?)', (path, *state, scan)
+        )
+
+    def start_scan(self, root: str, full: bool) -> tuple[int, bool]:
+        """Returns the id of a scan of root, and whether it checks every file.
+        If a scan of root was interrupted, it is resumed, unless it wasn't full
+        and a full one was asked for. The scan is recorded until finish_scan
+        is called, so the directories written with its id can be skipped if
+        it has to be resumed again."""
+        self.cursor.execute(
+            'SELECT id, full FROM scan_checkpoints WHERE root = ?', (root,)
+        )
+        if (scan := self.cursor.fetchone()) and (scan['full'] or not full):
+            return scan['id'], bool(scan['full'])
+        self.cursor.execute(
+            'DELETE FROM scan_checkpoints WHERE root = ?', (root,)
+        )
+        self.cursor.execute(
+            'INSERT INTO scan_checkpoints (root, full) VALUES (?, ?)',
+            (root, full),
+        )
+        scan = self.cursor.lastrowid
+        self.commit()
+        return scan, full
+
+    def finish_scan(self, scan: int):
+        self.cursor.execute('DELETE FROM scan_checkpoints WHERE id = ?', (scan,))
+
+    def add_scan_run(self, run: dict):
+        """Stores the metrics of a sync, as returned by ScanStats.as_row."""
+        self.cursor.execute(
+            f"""INSERT INTO scan_runs ({', '.join(run)})
+                VALUES ({', '.join('?' * len(run))})""",
+            tuple(run.values()),
+        )
 
-    def modify_time(self, path: str) -> float | None:
+    def scan_runs(self, limit: int = 10) -> list[sqlite3.Row]:
+        """Returns the metrics of the most recent syncs, newest first."""
         self.cursor.execute(
-            'SELECT modified FROM tracks WHERE path=?', (path,)
+            'SELECT * FROM scan_runs ORDER BY id DESC LIMIT ?', (limit,)
+        )
+        return self.cursor.fetchall()
+
+    def changes(self) -> int:
+        """Returns the number of rows written since the database was opened."""
+        return self.db.total_changes
+
+    def scanned_directories(self, root: str, scan: int) -> set[str]:
+        """Returns the directories under root (and root itself) that
+        were written and committed by the given scan."""
+        self.cursor.execute(
+            """SELECT path FROM directories
+                WHERE scan = ? AND (path = ? OR (path >= ? AND path < ?))""",
+            (scan, root, *_subtree(root)),
+        )
+        return {path[0] for path in self.cursor}
+
+    def remove_directories(self, paths: list[str]):
+        self.cursor.executemany(
+            'DELETE FROM directories WHERE path = ?', [(p,) for p in paths]
+        )
+
+    def cover_file_digest(self, path: str, stat: FileStat) -> str | None:
+        """Returns the hash of the cover image file at path, if it was
+        stored while the file had the given modification time and size."""
+        self.cursor.execute(
+            'SELECT digest FROM cover_files WHERE path = ? AND mtime = ? AND size = ?',
+            (path, *stat),
         )
         return result[0] if (result := self.cursor.fetchone()) else None
 
+    def update_cover_file(self, path: str, stat: FileStat, digest: str):
+        self.cursor.execute(
+            'INSERT INTO cover_files VALUES (?, ?, ?, ?)',
+            (path, *stat, digest),
+        )
+
+    def set_covers(self, paths: list[str], cover_paths: tuple[str, str]):
+        """Sets the thumbnail and cover of the tracks with the given paths."""
+        self.cursor.executemany(
+            'UPDATE tracks SET thumb = ?, cover = ? WHERE path = ?',
+            [(*cover_paths, path) for path in paths],
+        )
+        self._changed |= self.cursor.rowcount > 0
+
+    def add_cover(self, cover: CachedCover):
+        self.cursor.execute(
+            'INSERT INTO covers VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (*cover, time.time()),
+        )
+
+    def cover_paths(self, digest: str) -> tuple[str, str] | None:
+        """Returns the thumb and cover paths of a cached cover, or None if
+        it isn't cached. Looking a cover up marks it as recently used."""
+        self.cursor.execute(
+            'SELECT thumb, cover FROM covers WHERE digest = ?', (digest,)
+        )
+        if not (paths := self.cursor.fetchone()):
+            return None
+        self.cursor.execute(
+            'UPDATE covers SET used = ? WHERE digest = ?', (time.time(), digest)
+        )
+        return tuple(paths)
+
+    def unused_covers(self) -> list[str]:
+        """Returns the hashes of cached covers that no track uses anymore."""
+        self.cursor.execute(
+            'SELECT digest FROM [Cover References] WHERE refs = 0'
+        )
+        return [cover[0] for cover in self.cursor]
+
+    def cover_usage(self) -> list[tuple[str, int]]:
+        """Returns the hash and size on disk of every cached
+        cover, from least to most recently used."""
+        self.cursor.execute('SELECT digest, disk_size FROM covers ORDER BY used')
+        return [tuple(cover) for cover in self.cursor]
+
+    def cached_cover_digests(self) -> set[str]:
+        self.cursor.execute('SELECT digest FROM covers')
+        return {cover[0] for cover in self.cursor}
+
+    def cover_references(self) -> set[str]:
+        """Returns every thumb and cover path that tracks point to."""
+        self.cursor.execute(
+            """SELECT thumb FROM tracks WHERE thumb IS NOT NULL
+                UNION SELECT cover FROM tracks WHERE cover IS NOT NULL"""
+        )
+        return {path[0] for path in self.cursor}
+
+    def remove_covers(self, digests: list[str]):
+        """Removes covers from the cache's records. (Only covers no track
+        uses are removed, so no track is left pointing at one.)"""
+        self.cursor.executemany(
+            'DELETE FROM covers WHERE digest = ?', [(d,) for d in digests]
+        )
+
     def get_artists(self, all_artists=False) -> list[ArtistItem]:
         if all_artists:
             self.cursor.execute('SELECT * FROM [All Artists]')
@@ -100,43 +424,392 @@ class MusicDB:
             self.cursor.execute('SELECT * FROM [Album Artists]')
         return [ArtistItem(*artist) for artist in self.cursor.fetchall()]
 
-    def get_albums(self) -> list[AlbumItem]:
-        self.cursor.execute("""SELECT * FROM [Albums]""")
-        albums = []
-        for album in self.cursor.fetchall():
-            self.cursor.execute(
-                """SELECT DISTINCT name 
-                    FROM artists NATURAL JOIN tracks
-                    WHERE album = ? ORDER BY name""",
-                (album[0],),
-            )
-            artists = [a[0] for a in self.cursor.fetchall()]
-            tracks = self.get_tracks(album[0])
-            albums.append(
-                AlbumItem(**dict(album, artists=artists, tracks=tracks))
-            )
-        return albums
+    def get_albums(self, ids: set[int] | None = None) -> list[AlbumItem]:
+        """Returns every album, or only those with the given ids. The whole
+        set is loaded in two queries, one for the albums and one for their
+        artists, instead of several queries per album. Their tracks aren't
+        loaded, albums load them when they're first needed."""
+        where, params = _album_filter(ids, 'id')
+        self.cursor.execute(f'SELECT * FROM [Album Info] {where}', params)
+        albums = self.cursor.fetchall()
+
+        where, params = _album_filter(ids)
+        self.cursor.execute(
+            f"""SELECT DISTINCT album_id, name FROM tracks
+                JOIN track_artists ON track_id = tracks.id
+                JOIN artists ON artists.id = artist_id {where}
+                ORDER BY album_id, name""",
+            params,
+        )
+        artists: dict[int, list[str]] = {}
+        for album, name in self.cursor:
+            artists.setdefault(album, []).append(name)
+
+        return [
+            AlbumItem(**dict(album, artists=artists.get(album['id'], [])))
+            for album in albums
+        ]
+
+    def get_album_tracks(
+        self, ids: set[int] | None = None
+    ) -> dict[int, list[TrackItem]]:
+        """Returns the tracks of every album, or only those with the given
+        ids, keyed by album id."""
+        tracks: dict[int, list[TrackItem]] = {}
+        for track in self._query_tracks(*_album_filter(ids)):
+            tracks.setdefault(track.album_id, []).append(track)
+        return tracks
+
+    def search(self, query: str, limit: int = 20) -> SearchResults:
+        """Searches album titles and artists, artist names and track titles,
+        returning up to limit of each, best matches first. Every word in
+        the query has to match, and the last one can be the start of a word,
+        so results can be shown while the query is being typed."""
+        if not (match := _match_query(query)):
+            return SearchResults([], [], [])
+
+        # Matches are ranked within the FTS query, which keeps only the best
+        # ones, except for short prefixes, where the candidates are cut first.
+        if max(len(word) for word in query.split()) < SHORT_PREFIX:
+            order, candidates = '', SEARCH_CANDIDATES
+        else:
+            order, candidates = 'ORDER BY rank', limit
+
+        # album titles count for more than album artists
+        self.cursor.execute(
+            f"""SELECT rowid FROM (
+                    SELECT rowid, bm25(albums_search, 2.0, 1.0) AS rank
+                    FROM albums_search WHERE albums_search MATCH ?
+                    {order} LIMIT ?)
+                ORDER BY rank LIMIT ?""",
+            (match, candidates, limit),
+        )
+        ranks = {album[0]: i for i, album in enumerate(self.cursor)}
+        albums = sorted(self.get_albums(set(ranks)), key=lambda a: ranks[a.id])
+
+        self.cursor.execute(
+            f"""SELECT artists.name, sort, (SELECT COUNT(*) FROM albums
+                    WHERE artist_id = artists.id OR id IN (
+                        SELECT album_id FROM track_artists
+                        JOIN tracks ON tracks.id = track_id
+                        WHERE track_artists.artist_id = artists.id))
+                FROM (SELECT rowid, rank FROM artists_search
+                    WHERE artists_search MATCH ? {order} LIMIT ?) AS found
+                JOIN artists ON artists.id = found.rowid
+                ORDER BY found.rank LIMIT ?""",
+            (match, candidates, limit),
+        )
+        artists = [ArtistItem(*artist) for artist in self.cursor.fetchall()]
+
+        self.cursor.execute(
+            f"""SELECT path FROM (SELECT rowid, rank FROM tracks_search
+                    WHERE tracks_search MATCH ? {order} LIMIT ?) AS found
+                JOIN tracks ON tracks.id = found.rowid
+                ORDER BY found.rank LIMIT ?""",
+            (match, candidates, limit),
+        )
+        ranks = {track[0]: i for i, track in enumerate(self.cursor)}
+        tracks = self._query_tracks(
+            f"WHERE path IN ({', '.join('?' * len(ranks))})", tuple(ranks)
+        )
+        tracks.sort(key=lambda t: ranks[t.path])
+        return SearchResults(albums, artists, tracks)
 
-    def get_tracks(self, album: str) -> list[TrackItem]:
+    def _query_tracks(self, where: str, params: tuple) -> list[TrackItem]:
+        """Returns the tracks selected by the WHERE clause where. Each track's
+        artists, other than its album artist, are joined into one string by
+        the query itself."""
         self.cursor.execute(
-            """SELECT track, title, discnumber as disc, discsubtitle, albumartist,
-                length, path, thumb, cover
-                FROM tracks 
-                WHERE album = ? ORDER BY disc, track""",
-            (album,),
+            f"""SELECT album_id, albums.title as album, track,
+                tracks.title, discnumber as disc, discsubtitle,
+                artists.name as albumartist, length, path, thumb, cover,
+                (SELECT GROUP_CONCAT(name, ', ') FROM (
+                    SELECT name FROM track_artists
+                    JOIN artists ON artists.id = track_artists.artist_id
+                    WHERE track_id = tracks.id
+                    AND track_artists.artist_id != albums.artist_id
+                    ORDER BY name)) as artists
+                FROM tracks JOIN albums ON albums.id = album_id
+                JOIN artists ON artists.id = albums.artist_id
+                {where} ORDER BY album_id, disc, track""",
+            params,
         )
         tracks = []
-        for track in self.cursor.fetchall():
-            self.cursor.execute(
-                'SELECT name FROM artists WHERE path = ? AND name != ?',
-                (track[6], track[4]),
-            )
-            artists = ', '.join([a[0] for a in self.cursor.fetchall()])
+        for track in self.cursor:
             # remove None values
             track = {k: v for k, v in dict(track).items() if v is not None}
-            tracks.append(TrackItem(**track, artists=artists, album=album))
+            track.setdefault('artists', '')
+            tracks.append(TrackItem(**track))
         return tracks
 
+    def _album_id(self, title: str, artist: int, date: str | None) -> int:
+        """Returns the id of the album with the given title and album
+        artist id, adding it if it's new, and updates its date."""
+        self.cursor.execute(
+            """INSERT INTO albums (title, artist_id, date) VALUES (?, ?, ?)
+                ON CONFLICT (title, artist_id) DO UPDATE
+                SET date = coalesce(excluded.date, date)
+                RETURNING id""",
+            (title, artist, date),
+        )
+        return self.cursor.fetchone()[0]
+
+    def _ids(self, table: str, column: str, values) -> dict:
+        """Returns the ids of the rows of table whose column is one
+        of values, keyed by the value."""
+        values = tuple(values)
+        self.cursor.execute(
+            f"SELECT {column}, id FROM {table} WHERE {column} IN ({', '.join('?' * len(values))})",
+            values,
+        )
+        return dict(self.cursor.fetchall())
+
+    # The names of the migration methods, in the order they're run.
+    MIGRATIONS = (
+        '_create_schema',
+        '_add_indexes',
+        '_normalize',
+        '_add_search',
+        '_add_generation',
+        '_count_tracks',
+    )
+
+    def _needs_migration(self) -> bool:
+        if not os.path.exists(self.path):
+            return True
+        db = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True)
+        try:
+            version = db.execute('PRAGMA user_version').fetchone()[0]
+        finally:
+            db.close()
+        return version < len(self.MIGRATIONS)
+
+    def _migrate(self):
+        """Brings the schema up to date by running the migrations the database
+        hasn't had yet. The database's user_version is the number of migrations
+        that have been run on it. Each one runs in its own transaction along
+        with the update to user_version, so a failed migration is rolled back
+        and tried again on the next start.
+
+        Another connection can be migrating at the same time, (the database
+        service's reader and a sync both open one on the first start after an
+        upgrade) so the version is only read once the write lock is held,
+        which waits for the other connection's migration to finish first.
+
+        New schema changes are added as a new migration at the end of the
+        list. Migrations that have been released shouldn't be changed."""
+        while True:
+            self.cursor.execute('BEGIN IMMEDIATE')
+            self.cursor.execute('PRAGMA user_version')
+            version = self.cursor.fetchone()[0]
+            if version >= len(self.MIGRATIONS):
+                self.db.commit()
+                return
+            getattr(self, self.MIGRATIONS[version])()
+            self.cursor.execute(f'PRAGMA user_version = {version + 1}')
+            self.db.commit()
+
+    def _create_schema(self):
+        """Migration 1: creates the schema as it was before it was versioned,
+        or brings a database made before then up to it."""
+        if (columns := self._columns('tracks')) and 'size' not in columns:
+            # Databases from before file sizes were stored can't be compared
+            # against a file's stat results, so their tracks are dropped to be
+            # parsed again on the next sync.
+            self._execute_queries('DROP TABLE artists', 'DROP TABLE tracks')
+        self._create_tables()
+        if 'scan' not in self._columns('directories'):
+            # added when scans became resumable
+            self._execute_queries(
+                'ALTER TABLE directories ADD COLUMN scan INTEGER NOT NULL DEFAULT 0'
+            )
+        self._create_views()
+
+    def _add_indexes(self):
+        """Migration 2: indexes for the columns albums and artists are looked
+        up and grouped by. (Looking up artists by path is already covered by
+        their primary key, which starts with the path.)"""
+        self._execute_queries(
+            'CREATE INDEX tracks_album ON tracks(album, albumartist)',
+            'CREATE INDEX tracks_albumartist ON tracks(albumartist)',
+            'CREATE INDEX artists_name ON artists(name)',
+        )
+
+    def _normalize(self):
+        """Migration 3: splits albums and artists into their own tables with
+        integer ids, so albums are identified by title and album artist
+        together rather than by title alone, and joins compare ids instead
+        of strings. Tracks keep their data, and get their album and artists
+        linked by id."""
+        self._execute_queries(
+            'DROP VIEW [Albums]',
+            'DROP VIEW [Album Artists]',
+            'DROP VIEW [All Artists]',
+            'DROP VIEW [Cover References]',
+            # indexes keep their names when their table is renamed
+            'DROP INDEX tracks_album',
+            'DROP INDEX tracks_albumartist',
+            'DROP INDEX tracks_thumb',
+            'DROP INDEX artists_name',
+            'ALTER TABLE tracks RENAME TO old_tracks',
+            'ALTER TABLE artists RENAME TO old_artists',
+            """CREATE TABLE artists(
+                id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL UNIQUE,
+                sort TEXT)
+            """,
+            # an album is its title and album artist
+            """CREATE TABLE albums(
+                id INTEGER PRIMARY KEY,
+                title TEXT NOT NULL,
+                artist_id INTEGER NOT NULL REFERENCES artists(id),
+                date DATE,
+                UNIQUE (title, artist_id))
+            """,
+            """CREATE TABLE tracks(
+                id INTEGER PRIMARY KEY,
+                path TEXT NOT NULL UNIQUE,
+                album_id INTEGER NOT NULL REFERENCES albums(id),
+                title TEXT NOT NULL,
+                track TEXT NOT NULL,
+                discnumber TEXT,
+                discsubtitle TEXT,
+                length REAL NOT NULL,
+                thumb TEXT,
+                cover TEXT,
+                modified INTEGER NOT NULL,
+                size INTEGER NOT NULL)
+            """,
+            # tracks can have multiple artists
+            """CREATE TABLE track_artists(
+                track_id INTEGER NOT NULL REFERENCES tracks(id) ON DELETE CASCADE,
+                artist_id INTEGER NOT NULL REFERENCES artists(id),
+                PRIMARY KEY (track_id, artist_id)) WITHOUT ROWID
+            """,
+            'CREATE INDEX tracks_album ON tracks(album_id)',
+            'CREATE INDEX tracks_thumb ON tracks(thumb)',
+            'CREATE INDEX albums_artist ON albums(artist_id)',
+            'CREATE INDEX track_artists_artist ON track_artists(artist_id)',
+            # moves the existing data over
+            """INSERT INTO artists (name, sort)
+                SELECT name, MAX(sort) FROM old_artists GROUP BY name
+            """,
+            """INSERT OR IGNORE INTO artists (name)
+                SELECT DISTINCT coalesce(albumartist, 'Unknown Artist') FROM old_tracks
+            """,
+            """INSERT INTO albums (title, artist_id, date)
+                SELECT album, artists.id, MAX(date) FROM old_tracks
+                JOIN artists ON name = coalesce(albumartist, 'Unknown Artist')
+                GROUP BY album, artists.id
+            """,
+            """INSERT INTO tracks (path, album_id, title, track, discnumber,
+                discsubtitle, length, thumb, cover, modified, size)
+                SELECT path, albums.id, old_tracks.title, track, discnumber,
+                discsubtitle, length, thumb, cover, modified, size
+                FROM old_tracks JOIN artists
+                ON name = coalesce(albumartist, 'Unknown Artist')
+                JOIN albums ON albums.title = album AND artist_id = artists.id
+            """,
+            """INSERT OR IGNORE INTO track_artists
+                SELECT tracks.id, artists.id FROM old_artists
+                JOIN tracks USING (path) JOIN artists USING (name)
+            """,
+            'DROP TABLE old_artists',
+            'DROP TABLE old_tracks',
+            # (table names are case insensitive, so this can't be [Albums])
+            """CREATE VIEW [Album Info] AS
+            SELECT albums.id, albums.title, name as albumartist,
+            SUM(length) as length, date, thumb, cover
+            FROM albums JOIN artists ON artists.id = artist_id
+            JOIN tracks ON album_id = albums.id
+            GROUP BY albums.id
+            """,
+            """CREATE VIEW [Album Artists] AS
+            SELECT name, sort, COUNT(albums.id)
+            FROM artists JOIN albums ON artist_id = artists.id
+            GROUP BY artists.id
+            """,
+            """CREATE VIEW [All Artists] AS
+            SELECT name, sort, COUNT(DISTINCT album_id)
+            FROM artists JOIN track_artists ON artist_id = artists.id
+            JOIN tracks ON tracks.id = track_id
+            GROUP BY artists.id
+            """,
+            # A track's thumb and cover are always set together,
+            # so counting the tracks using the thumb is enough.
+            """CREATE VIEW [Cover References] AS
+            SELECT digest, COUNT(tracks.id) AS refs
+            FROM covers LEFT JOIN tracks ON tracks.thumb = covers.thumb
+            GROUP BY digest
+            """,
+        )
+
+    def _add_search(self):
+        """Migration 4: full text indexes of artist names, album titles and
+        artists, and track titles, for search. Each index's rowids are the ids
+        of what it indexes, and triggers keep it in sync with its table.
+        Prefixes of up to three characters are indexed as well, since those
+        are the ones that match the most words while a query is being typed."""
+        options = "tokenize = 'unicode61 remove_diacritics 2', prefix = '1 2 3'"
+        self._execute_queries(
+            f'CREATE VIRTUAL TABLE artists_search USING fts5(name, {options})',
+            f'CREATE VIRTUAL TABLE albums_search USING fts5(title, albumartist, {options})',
+            f'CREATE VIRTUAL TABLE tracks_search USING fts5(title, {options})',
+            """CREATE TRIGGER artists_search_insert AFTER INSERT ON artists BEGIN
+                INSERT INTO artists_search (rowid, name) VALUES (new.id, new.name);
+            END""",
+            """CREATE TRIGGER artists_search_delete AFTER DELETE ON artists BEGIN
+                DELETE FROM artists_search WHERE rowid = old.id;
+            END""",
+            """CREATE TRIGGER albums_search_insert AFTER INSERT ON albums BEGIN
+                INSERT INTO albums_search (rowid, title, albumartist)
+                SELECT new.id, new.title, name FROM artists WHERE id = new.artist_id;
+            END""",
+            """CREATE TRIGGER albums_search_delete AFTER DELETE ON albums BEGIN
+                DELETE FROM albums_search WHERE rowid = old.id;
+            END""",
+            """CREATE TRIGGER tracks_search_insert AFTER INSERT ON tracks BEGIN
+                INSERT INTO tracks_search (rowid, title) VALUES (new.id, new.title);
+            END""",
+            # every sync of a track updates its title, even if it's unchanged
+            """CREATE TRIGGER tracks_search_update AFTER UPDATE OF title ON tracks
+            WHEN old.title != new.title BEGIN
+                UPDATE tracks_search SET title = new.title WHERE rowid = new.id;
+            END""",
+            """CREATE TRIGGER tracks_search_delete AFTER DELETE ON tracks BEGIN
+                DELETE FROM tracks_search WHERE rowid = old.id;
+            END""",
+            'INSERT INTO artists_search (rowid, name) SELECT id, name FROM artists',
+            """INSERT INTO albums_search (rowid, title, albumartist)
+                SELECT albums.id, title, name FROM albums
+                JOIN artists ON artists.id = artist_id""",
+            'INSERT INTO tracks_search (rowid, title) SELECT id, title FROM tracks',
+        )
+
+    def _add_generation(self):
+        """Migration 5: the library's generation counter. It starts from a
+        random number, so a database that was deleted and created again
+        doesn't reuse the generations of the one it replaced."""
+        self._execute_queries(
+            'CREATE TABLE generation(value INTEGER NOT NULL)',
+            'INSERT INTO generation VALUES (abs(random() >> 1))',
+        )
+
+    def _count_tracks(self):
+        """Migration 6: adds the number of tracks to [Album Info], so albums
+        can be listed without loading their tracks."""
+        self._execute_queries(
+            'DROP VIEW [Album Info]',
+            """CREATE VIEW [Album Info] AS
+            SELECT albums.id, albums.title, name as albumartist,
+            SUM(length) as length, COUNT(tracks.id) as num_tracks,
+            date, thumb, cover
+            FROM albums JOIN artists ON artists.id = artist_id
+            JOIN tracks ON album_id = albums.id
+            GROUP BY albums.id
+            """,
+        )
+
     def _create_tables(self):
         self._execute_queries(
             """CREATE TABLE IF NOT EXISTS tracks(
@@ -151,7 +824,8 @@ class MusicDB:
                 thumb TEXT,
                 cover TEXT,
                 path TEXT NOT NULL,
-                modified REAL NOT NULL,
+                modified INTEGER NOT NULL,
+                size INTEGER NOT NULL,
                 PRIMARY KEY (path) ON CONFLICT REPLACE)
             """,
             # artists needs a separate table because tracks can have multiple artists
@@ -162,24 +836,123 @@ class MusicDB:
                 PRIMARY KEY (path, name) ON CONFLICT REPLACE,
                 FOREIGN KEY (path) REFERENCES tracks(path) ON DELETE CASCADE)
             """,
+            """CREATE TABLE IF NOT EXISTS directories(
+                path TEXT NOT NULL,
+                mtime INTEGER NOT NULL,
+                entries INTEGER NOT NULL,
+                fingerprint TEXT NOT NULL,
+                scan INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (path) ON CONFLICT REPLACE)
+            """,
+            # Syncs that haven't finished yet. Each directory is stored with the
+            # id of the scan that wrote it, so an interrupted scan can skip
+            # the directories it had already committed when it's resumed.
+            """CREATE TABLE IF NOT EXISTS scan_checkpoints(
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                root TEXT NOT NULL,
+                full INTEGER NOT NULL)
+            """,
+            # metrics of each sync, see scan_stats.py
+            """CREATE TABLE IF NOT EXISTS scan_runs(
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                root TEXT NOT NULL,
+                started REAL NOT NULL,
+                full INTEGER NOT NULL,
+                resumed INTEGER NOT NULL,
+                directories INTEGER NOT NULL,
+                directories_skipped INTEGER NOT NULL,
+                files_checked INTEGER NOT NULL,
+                files_unchanged INTEGER NOT NULL,
+                files_parsed INTEGER NOT NULL,
+                covers_decoded INTEGER NOT NULL,
+                covers_reused INTEGER NOT NULL,
+                rows_written INTEGER NOT NULL,
+                bytes_read INTEGER NOT NULL,
+                walk REAL NOT NULL,
+                stat REAL NOT NULL,
+                wait_tags REAL NOT NULL,
+                parse REAL NOT NULL,
+                write REAL NOT NULL,
+                wait_covers REAL NOT NULL,
+                decode REAL NOT NULL,
+                flush REAL NOT NULL,
+                cleanup REAL NOT NULL,
+                total REAL NOT NULL)
+            """,
+            # caches the hashes of external cover files (cover.jpg, etc.)
+            """CREATE TABLE IF NOT EXISTS cover_files(
+                path TEXT NOT NULL,
+                mtime INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                digest TEXT NOT NULL,
+                PRIMARY KEY (path) ON CONFLICT REPLACE)
+            """,
+            # every image in the cover cache, and when it was last used by a sync
+            """CREATE TABLE IF NOT EXISTS covers(
+                digest TEXT NOT NULL,
+                width INTEGER NOT NULL,
+                height INTEGER NOT NULL,
+                disk_size INTEGER NOT NULL,
+                thumb TEXT NOT NULL,
+                cover TEXT NOT NULL,
+                used REAL NOT NULL,
+                PRIMARY KEY (digest) ON CONFLICT REPLACE)
+            """,
+            'CREATE INDEX IF NOT EXISTS tracks_thumb ON tracks(thumb)',
+            # A track's thumb and cover are always set together,
+            # so counting the tracks using the thumb is enough.
+            """CREATE VIEW IF NOT EXISTS [Cover References] AS
+            SELECT digest, COUNT(tracks.path) AS refs
+            FROM covers LEFT JOIN tracks ON tracks.thumb = covers.thumb
+            GROUP BY digest
+            """,
         )
 
     def _create_views(self):
         self._execute_queries(
-            """CREATE VIEW [Albums] AS
+            """CREATE VIEW IF NOT EXISTS [Albums] AS
             SELECT DISTINCT album as title, albumartist, SUM(length) as length, date, thumb, cover
             FROM tracks GROUP BY album, albumartist
             """,
-            """CREATE VIEW [Album Artists] AS
+            """CREATE VIEW IF NOT EXISTS [Album Artists] AS
             SELECT DISTINCT albumartist, sort, COUNT(DISTINCT album)
             FROM tracks NATURAL JOIN artists WHERE albumartist IS NOT NULL GROUP BY albumartist
             """,
-            """CREATE VIEW [All Artists] AS
+            """CREATE VIEW IF NOT EXISTS [All Artists] AS
             SELECT DISTINCT name, sort, COUNT(DISTINCT album)
             FROM tracks NATURAL JOIN artists GROUP BY name""",
         )
 
+    def _columns(self, table: str) -> list[str]:
+        self.cursor.execute(f'PRAGMA table_info({table})')
+        return [column['name'] for column in self.cursor.fetchall()]
+
     def _execute_queries(self, *queries: str):
         for query in queries:
             self.cursor.execute(query)
-        self.db.commit()
+
+
+def _album_filter(
+    ids: set[int] | None, column: str = 'album_id'
+) -> tuple[str, tuple]:
+    """Returns a WHERE clause selecting the rows whose column is one of
+    the given album ids, and its parameters. None selects all rows."""
+    if ids is None:
+        return '', ()
+    return f"WHERE {column} IN ({', '.join('?' * len(ids))})", tuple(ids)
+
+
+def _match_query(query: str) -> str:
+    """Turns a search typed by the user into an FTS5 query matching rows
+    containing every word, with each word also matching as a prefix. Words
+    are quoted, so characters that mean something to FTS5 are searched for
+    as they are."""
+    words = ['"{}"*'.format(word.replace('"', '""')) for word in query.split()]
+    return ' '.join(words)
+
+
+def _subtree(root: str) -> tuple[str, str]:
+    """Returns bounds that every path under root sorts between, so that
+    a directory's contents can be selected with an indexable range instead
+    of a LIKE pattern. ('0' is the character after '/'.)"""
+    return f'{root}/', f'{root}0'
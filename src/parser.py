@@ -1,238 +1,597 @@
 from gi.repository import GLib, GObject
-from hashlib import sha256
-from io import BytesIO
-import mimetypes
-import mutagen
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from concurrent.futures import ProcessPoolExecutor
+from queue import Full, Queue
+from hashlib import sha1
+import heapq
+from typing import Iterator
+import multiprocessing
 import os
-from PIL import Image
-from PIL import UnidentifiedImageError
 import contextlib
+import threading
+from collections import namedtuple
+
+from .covers import CoverStore
+from .musicdb import MusicDB, DirectoryState
+from .scan_stats import ScanStats
+from .scan_worker import (
+    ArtistTags,
+    CoverImage,
+    CoverPaths,
+    FileStat,
+    TrackTags,
+    is_audio,
+    read_directory,
+    save_cover,
+    save_cover_file,
+    timed,
+)
+
+
+class DirectoryWalker:
+    """Walks a directory tree with os.scandir, yielding each directory's files
+    as soon as it is listed rather than waiting for the whole tree to be found.
+    The yielded DirEntry objects cache their stat results, so checking them
+    doesn't cost another syscall. Since the size of the tree isn't known up front,
+    progress is estimated from the directories discovered so far. (The visited
+    and discovered counts are summed over every root's walker by the parser.)
+
+    Each directory is yielded with a DirectoryState built only from the directory's
+    own inode and the names in it, so that unchanged directories can be skipped
+    without stat'ing any of their files.
+
+    By default, directories are visited depth first in name order. With
+    newest_first, the directories found so far are kept in a priority queue
+    and the most recently modified one is visited next. Adding an album
+    updates the mtime of the directory it was added to, so in the usual
+    Artist/Album layout new albums are reached before the rest of the
+    tree is walked."""
+
+    def __init__(self, path: str, newest_first: bool = False):
+        self.path = path
+        self.newest_first = newest_first
+        self.discovered = 1
+        self.visited = 0
+        # Directories that couldn't be read, other than ones that no longer
+        # exist. What's known to be under them is kept, since it can't be
+        # told whether it's still there.
+        self.unreadable: list[str] = []
+
+    def __iter__(
+        self,
+    ) -> Iterator[tuple[str, DirectoryState, list[os.DirEntry]]]:
+        try:
+            # (-mtime, path) when newest first, else (path, mtime)
+            frontier = [self._item(self.path, os.stat(self.path).st_mtime_ns)]
+        except OSError as error:
+            self._failed(self.path, error)
+            return
+        while frontier:
+            if self.newest_first:
+                mtime, root = heapq.heappop(frontier)
+                mtime = -mtime
+            else:
+                root, mtime = frontier.pop()
+            self.visited += 1
+            try:
+                with os.scandir(root) as it:
+                    entries = sorted(it, key=lambda e: e.name)
+            except OSError as error:
+                self._failed(root, error)
+                continue
+
+            files, subdirs = [], []
+            for entry in entries:
+                if not self._is_dir(entry):
+                    files.append(entry)
+                elif not entry.is_symlink() and (sub := self._mtime(entry)):
+                    subdirs.append((entry.path, sub))
+            if self.newest_first:
+                for sub in subdirs:
+                    heapq.heappush(frontier, self._item(*sub))
+            else:
+                # pushed in reverse so they're popped in name order
+                frontier.extend(reversed(subdirs))
+            self.discovered += len(subdirs)
+            yield root, self._state(mtime, entries), files
+
+    def _item(self, path: str, mtime: int) -> tuple:
+        return (-mtime, path) if self.newest_first else (path, mtime)
+
+    def _state(self, mtime: int, entries: list[os.DirEntry]) -> DirectoryState:
+        names = '\0'.join(entry.name for entry in entries)
+        return DirectoryState(
+            mtime,
+            len(entries),
+            sha1(names.encode(errors='surrogateescape')).hexdigest(),
+        )
 
-from .musicdb import MusicDB, ArtistTags, TrackTags
-
-CoverPaths = tuple[str, str]
-
+    def _is_dir(self, entry: os.DirEntry) -> bool:
+        try:
+            return entry.is_dir()
+        except OSError:
+            return False
 
-class CoverImage:
-    """A class that represents a cover image for an album,
-    with methods for converting it to a thumbnail and a larger
-    image, and saving these images to the cache. Must be
-    provided with the image data as a bytes object on init"""
+    def _mtime(self, entry: os.DirEntry) -> int | None:
+        try:
+            return entry.stat().st_mtime_ns
+        except OSError as error:
+            self._failed(entry.path, error)
+            return None
 
-    def __init__(self, image: bytes):
-        self.image = image
+    def _failed(self, path: str, error: OSError):
+        if not isinstance(error, (FileNotFoundError, NotADirectoryError)):
+            self.unreadable.append(path)
 
-    def sha256(self) -> str:
-        return sha256(self.image).hexdigest()
 
-    def cache_path(self) -> str:
-        cache_dir = f'{GLib.get_user_cache_dir()}/RecordBox'
-        return f'{cache_dir}/{self.sha256()}.png'
+class CoverQueue:
+    """Covers waiting to be saved to the cover store by their own pool of worker
+    processes, so writing tags to the database never waits on Pillow. Tracks are
+    written without art and get their cover paths filled in when their cover's
+    job finishes. (Jobs for an image that's already being saved are shared.)"""
 
-    def thumbnail(self) -> Image.Image | None:
-        return self._resize(128)
+    def __init__(
+        self, pool: ProcessPoolExecutor, store: CoverStore, stats: ScanStats
+    ):
+        self.pool = pool
+        self.store = store
+        self.stats = stats
+        # the tracks waiting on each job, and the cover file it's reading, if any
+        self._jobs: dict[Future, tuple[list[str], str | None, FileStat]] = {}
+        self._images: dict[str, Future] = {}
+
+    def add_image(self, tracks: list[str], cover: CoverImage):
+        if job := self._images.get(cover.digest):
+            self._jobs[job][0].extend(tracks)
+            return
+        job = self.pool.submit(
+            timed, save_cover, cover, self.store.root, self.store.sizes
+        )
+        self._images[cover.digest] = job
+        self._jobs[job] = (tracks, None, (0, 0))
 
-    def large(self) -> Image.Image | None:
-        return self._resize(512)
+    def add_file(self, tracks: list[str], file: str, stat: FileStat):
+        job = self.pool.submit(
+            timed, save_cover_file, file, self.store.root, self.store.sizes
+        )
+        self._jobs[job] = (tracks, file, stat)
 
-    def save(self) -> CoverPaths | None:
-        thumbnail = self.save_thumbnail()
-        large = self.save_large()
-        return (thumbnail, large) if thumbnail and large else None
+    def collect(self, db: MusicDB, block: bool = False):
+        """Sets the cover paths of the tracks whose covers are done.
+        Args:
+            db: The database the tracks were written to.
+            block: Wait for all the remaining jobs to finish.
+        """
+        if block:
+            with self.stats.timer('wait_covers'):
+                done = wait(self._jobs).done
+        else:
+            done = [job for job in self._jobs if job.done()]
+        for job in done:
+            tracks, file, stat = self._jobs.pop(job)
+            if not file:
+                self._images = {
+                    d: j for d, j in self._images.items() if j is not job
+                }
+            cover, seconds = job.result()
+            self.stats.add_time('decode', seconds)
+            if cover:
+                self.stats.count('covers_decoded')
+                db.add_cover(cover)
+                if file:
+                    db.update_cover_file(file, stat, cover.digest)
+                db.set_covers(tracks, (cover.thumb, cover.cover))
+
+
+class SyncStopped(Exception):
+    """Raised in a walker thread when the sync it's part of has stopped."""
+
+
+class RootScan:
+    """What the database knows about one of the roots being synced, loaded
+    up front so the root's walker thread never needs the database."""
+
+    def __init__(self, db: MusicDB, path: str, id: int = 0, full: bool = False):
+        self.path = path
+        # the id of the scan in the scan_checkpoints table, or 0 if none
+        self.id = id
+        self.full = full
+        self.known = db.file_stats(path)
+        self.directories = db.directory_states(path)
+        self.scanned = db.scanned_directories(path, id) if id else set()
+        self.walker: DirectoryWalker | None = None
+        # every file the walker found, including in skipped directories,
+        # so known files it didn't find can be removed once it's done
+        self.seen: set[str] = set()
+
+
+# A directory a walker thread hands to the writer: its path, its state, the
+# id of the scan it's part of, its cover file, and the result of reading its
+# changed files, if there were any.
+WalkedDirectory = namedtuple(
+    'WalkedDirectory', ['path', 'state', 'scan', 'cover_file', 'result']
+)
 
-    def save_thumbnail(self) -> str | None:
-        path = self._save('/RecordBox/thumbnails')
-        if os.path.exists(path):
-            return path
-        if image := self.thumbnail():
-            image.save(path)
-            return path
 
-    def save_large(self) -> str | None:
-        path = self._save('/RecordBox/large')
-        if os.path.exists(path):
-            return path
-        if image := self.large():
-            image.save(path)
-            return path
+class MusicParser(GObject.Object):
+    """A class that parses a directory of audio files and sends them to a database.
+    Reading tags is farmed out to a pool of worker processes, while the results
+    are written to the database from the thread that calls build."""
 
-    def _save(self, path):
-        thumb_dir = f'{GLib.get_user_cache_dir()}{path}'
-        result = f'{thumb_dir}/{self.sha256()}.png'
-        if not os.path.exists(thumb_dir):
-            os.makedirs(thumb_dir, exist_ok=True)
-        return result
+    path = GObject.Property(type=str, default='')
 
-    def _resize(self, size):
-        try:
-            image = Image.open(BytesIO(self.image))
-            image = image.convert('RGB')
-            image.thumbnail((size, size))
-            return image
-        except UnidentifiedImageError:
-            return None
+    # More directories to sync along with path, e.g. on other drives.
+    extra_paths = GObject.Property(type=GObject.TYPE_STRV)
 
+    # Number of worker processes used to read tags. 0 uses one per CPU core.
+    workers = GObject.Property(type=int, default=0)
 
-class AudioFile:
-    """A wrapper around mutagen's File class that provides an interface
-    for extracting metadata from audio files in a format more suitable
-    for inserting into RecordBox's database."""
+    # Visit the most recently modified directories first, so new music is
+    # parsed and committed early in a sync instead of wherever it falls in
+    # the tree. (See DirectoryWalker.)
+    newest_first = GObject.Property(type=bool, default=True)
 
-    def __init__(self, audio, file: str):
-        self.audio = audio
-        self.file = file
+    progress = GObject.Property(type=float, default=0.0)
 
-    def try_key(self, key: str) -> str | None:
-        """Attempts to get a key from the audio file.
-        Args:
-            key: The key to get from the audio file.
-        """
+    # Number of directories written between commits during a sync. Smaller
+    # batches lose less work if a sync is interrupted, larger ones are faster.
+    batch_size = GObject.Property(type=int, default=100)
 
-        return self.audio[key][0] if key in self.audio else None
+    # Size limit of the cover cache in megabytes, which covers no track uses
+    # are kept under. 0 means they aren't kept.
+    cover_cache_size = GObject.Property(type=int, default=0)
 
-    def try_key_all(self, key: str) -> list[str]:
-        return self.audio[key] if key in self.audio else []
+    # Emits each time build commits a batch, with the ids of the albums
+    # written in it, so they can be shown before the sync is done. Emitted
+    # on the thread running build, not the main loop.
+    batch_committed = GObject.Signal(arg_types=(GObject.TYPE_PYOBJECT,))
 
-    def artists(self) -> list[ArtistTags]:
-        """Returns a list of the artists associated with the audio file."""
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.covers = CoverStore()
+        # metrics of the sync that's running, or ran last
+        self.stats = ScanStats()
+        # albums written since the last commit
+        self._batch: set[int] = set()
+        self._walkers: list[DirectoryWalker] = []
+        # tells the walker threads to stop when the writer stops
+        self._stop = threading.Event()
+
+    def roots(self) -> list[str]:
+        """Returns the library's root directories, path and extra_paths, leaving
+        out any inside another root, since they get synced along with it."""
+        paths = sorted(
+            {
+                os.path.normpath(p)
+                for p in (self.path, *(self.extra_paths or []))
+                if p
+            }
+        )
         return [
-            ArtistTags(str(artist), self.try_key('artistsort'), self.file)
-            for artist in self.try_key_all('artist')
+            path
+            for i, path in enumerate(paths)
+            if not any(path.startswith(f'{p}/') for p in paths[:i])
         ]
 
-    def track_tags(self, cover_paths: CoverPaths | None) -> TrackTags:
-        """Returns the track information from the audio file."""
-        thumb, cover = cover_paths or (None, None)
-        return TrackTags(
-            self.try_key('title') or 'Unknown Title',
-            self.try_key('tracknumber') or '0',
-            self.try_key('discnumber'),
-            self.try_key('discsubtitle'),
-            self.try_key('album') or 'Unknown Album',
-            self.try_key('albumartist'),
-            self.try_key('date'),
-            self.audio.info.length,
-            thumb,
-            cover,
-            self.file,
-            os.path.getmtime(self.file),
-            self.artists(),
-        )
-
-    def embedded_cover(self) -> CoverImage | None:
-        """Extracts the embedded cover image from the audio file,
-        if it exists. Otherwise, returns None."""
-        if full := mutagen.File(self.file):
-            if 'covr' in full.tags:
-                try:
-                    return CoverImage(full.tags['covr'][0].data)
-                except AttributeError:
-                    return None
-            elif 'APIC:' in full:
-                return CoverImage(full.tags.get('APIC:').data)
-            else:
-                with contextlib.suppress(AttributeError):
-                    return (
-                        CoverImage(full.pictures[0].data)
-                        if full.pictures
-                        else None
-                    )
-
-    def check_need_update(self, mod_time: float) -> bool:
-        """Checks if the audio file has been modified since the last time it was parsed
+    def build(self, db: MusicDB, full: bool = False):
+        """Builds the database from the library's root directories.
         Args:
-            mod_time: The last time the audio file was parsed
-        """
-        return os.path.getmtime(self.file) > mod_time
-
-
-class MusicParser(GObject.Object):
-    """A class that parses a directory of audio files and sends them to a database."""
-
-    path = GObject.Property(type=str, default='')
-
-    def __init__(self, path=os.path.expanduser('~/Music'), **kwargs):
-        super().__init__(**kwargs)
-        self._total_dirs = int(os.popen(f'find {path} -type d | wc -l').read())
-        self._dirs_visited = 0
+            db: The MusicDB object to send the parsed data to.
+            full: If True, every file is checked for changes. Otherwise
+                directories whose entries haven't changed since the last sync
+                are skipped. (Which misses files that were rewritten in place.)
 
-    progress = GObject.Property(type=float, default=0.0)
+        Results are committed every batch_size directories, and if a sync
+        is interrupted, the next one picks up where it left off. Metrics of
+        each sync are stored in the database's scan_runs table.
+        """
+        roots = self.roots()
+        self.stats = stats = ScanStats(', '.join(roots), full)
+        self._batch = set()
+        changes = db.changes()
+        with stats.timer('total'):
+            with stats.timer('cleanup'):
+                db.remove_outside(roots)
+            # Roots that can't be reached, like an unmounted drive, are left
+            # alone rather than having all of their tracks removed.
+            scans = [
+                RootScan(db, path, *db.start_scan(path, full))
+                for path in roots
+                if os.path.isdir(path)
+            ]
+            stats.full = any(scan.full for scan in scans)
+            stats.resumed = any(scan.scanned for scan in scans)
+            self._parse(db, scans, checkpoint=True)
+            for scan in scans:
+                db.finish_scan(scan.id)
+            with stats.timer('flush'):
+                db.commit()
+            with stats.timer('cleanup'):
+                # Only full syncs and ones that finish an interrupted sync
+                # look for stray files, since that means walking the cache.
+                self.covers.collect_garbage(
+                    db,
+                    self.cover_cache_size * 1024 * 1024,
+                    sweep=stats.full or stats.resumed,
+                )
+        stats.count('rows_written', db.changes() - changes)
+        db.add_scan_run(stats.as_row())
+        db.commit()
 
-    def build(self, db: MusicDB):
-        """Builds the database from the given directory.
+    def update_directories(self, db: MusicDB, paths: list[str]) -> set[int]:
+        """Syncs only the given directories and everything under them, for picking
+        up changes to a part of the library without walking all of it.
         Args:
             db: The MusicDB object to send the parsed data to.
+            paths: The directories to sync. (They don't need to still exist.)
+        Returns:
+            The ids of the albums that were added, changed or removed.
         """
-        db.remove_missing(self.path)
-        self._parse(db, self.path)
+        self.stats = ScanStats()
+        self._batch = set()
+        paths = [os.path.normpath(path) for path in paths]
+        albums = set()
+        for path in paths:
+            albums |= db.album_ids(path)
+        self._parse(db, [RootScan(db, path, full=True) for path in paths])
+        for path in paths:
+            albums |= db.album_ids(path)
         db.commit()
-        self._dirs_visited = 0
+        return albums
 
-    def _parse(self, db: MusicDB, path: str):
-        """Recursively parses the given directory and sends the parsed data to the database."""
-        for root, _, files in os.walk(path):
-            tracks = []
-            for file in files:
-                if track := self._parse_file(f'{root}/{file}', db):
-                    tracks.append(track)
+    def _parse(
+        self, db: MusicDB, roots: list['RootScan'], checkpoint: bool = False
+    ):
+        """Walks the given roots, with a thread for each device they're on, and
+        writes the directories the walkers hand back to the database. Only the
+        thread calling this writes to the database.
+        Args:
+            db: The MusicDB object to send the parsed data to.
+            roots: The roots to walk.
+            checkpoint: Commit every batch_size directories.
+        """
+        results = Queue(maxsize=self._pool_size() * 4)
+        self._stop.clear()
+        for root in roots:
+            root.walker = DirectoryWalker(root.path, self.newest_first)
+        self._walkers = [root.walker for root in roots]
+        devices: dict[int | None, list[RootScan]] = {}
+        for root in roots:
+            devices.setdefault(_device(root.path), []).append(root)
+        for device_roots in devices.values():
+            threading.Thread(
+                target=self._walk_device,
+                args=(device_roots, results),
+                daemon=True,
+            ).start()
+
+        remaining = len(roots)
+        written = 0
+        try:
+            with self._pool() as cover_pool:
+                covers = CoverQueue(cover_pool, self.covers, self.stats)
+                while remaining:
+                    match results.get():
+                        case WalkedDirectory() as directory:
+                            self._write_directory(db, directory, covers)
+                            written += 1
+                        case RootScan() as root:
+                            self._remove_missing(db, root)
+                            remaining -= 1
+                        case BaseException() as error:
+                            raise error
+                    covers.collect(db)
+                    if checkpoint and written >= max(self.batch_size, 1):
+                        self._checkpoint(db, covers)
+                        written = 0
+                covers.collect(db, block=True)
+            with self.stats.timer('cleanup'):
+                db.remove_orphans()
+        finally:
+            # stops the walkers if this was interrupted
+            self._stop.set()
+
+    def _remove_missing(self, db: MusicDB, root: 'RootScan'):
+        """Removes the tracks and directories of a root that its walker
+        didn't find, other than those under directories it couldn't read."""
+        unreadable = root.walker.unreadable
+        missing = root.known.keys() - root.seen
+        db.remove_tracks([p for p in missing if not _under(p, unreadable)])
+        db.remove_directories(
+            [d for d in root.directories if not _under(d, unreadable)]
+        )
 
-            self._update_progress()
-            if tracks:
-                external_cover = self._pick_cover(root)
-                self._send_to_db(db, tracks, external_cover)
+    def _walk_device(self, roots: list['RootScan'], results: Queue):
+        """Walks roots that are all on the same device, reading the tags of
+        changed files with the device's own pool of workers, and hands each
+        directory to the writer once its tags are read. (So a slow device,
+        like a network mount, only holds up its own roots.)"""
+        try:
+            with self._pool() as pool:
+                for root in roots:
+                    self._walk_root(root, pool, results)
+        except SyncStopped:
+            pass
+        except BaseException as error:
+            with contextlib.suppress(SyncStopped):
+                self._hand_over(results, error)
+
+    def _walk_root(
+        self, root: 'RootScan', pool: ProcessPoolExecutor, results: Queue
+    ):
+        pending: dict[
+            Future, tuple[str, DirectoryState, os.DirEntry | None]
+        ] = {}
+        stats = self.stats
+        for path, state, files in stats.timed(root.walker, 'walk'):
+            stats.count('directories')
+            root.seen.update(file.path for file in files)
+            unchanged = root.directories.pop(path, None) == state
+            if unchanged and (not root.full or path in root.scanned):
+                stats.count('directories_skipped')
+                self._update_progress()
+                continue
+
+            with stats.timer('stat'):
+                changed = {
+                    file.path: stat
+                    for file in files
+                    if (stat := self._changed_stat(file, root.known))
+                }
+            if changed:
+                cover = self._pick_cover(files)
+                job = pool.submit(
+                    timed, read_directory, changed, cover is None
+                )
+                pending[job] = (path, state, cover)
+            else:
+                self._hand_over(
+                    results, WalkedDirectory(path, state, root.id, None, None)
+                )
 
-    def _update_progress(self):
-        self._dirs_visited += 1
-        GLib.idle_add(
-            self.set_property,
-            'progress',
-            self._dirs_visited / self._total_dirs,
+            self._update_progress()
+            # Bound the number of queued directories so results don't
+            # pile up in memory faster than they can be written.
+            if len(pending) >= self._pool_size() * 4:
+                with stats.timer('wait_tags'):
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                self._hand_over_jobs(done, pending, root, results)
+        with stats.timer('wait_tags'):
+            done = wait(pending).done
+        self._hand_over_jobs(done, pending, root, results)
+        self._hand_over(results, root)
+
+    def _hand_over_jobs(
+        self,
+        done: set[Future],
+        pending: dict[Future, tuple[str, DirectoryState, os.DirEntry | None]],
+        root: 'RootScan',
+        results: Queue,
+    ):
+        for job in done:
+            path, state, cover_file = pending.pop(job)
+            self._hand_over(
+                results,
+                WalkedDirectory(
+                    path, state, root.id, cover_file, job.result()
+                ),
+            )
+
+    def _hand_over(self, results: Queue, item):
+        """Puts item in the writer's queue, waiting while it's full,
+        unless the writer stopped, in which case SyncStopped is raised."""
+        while not self._stop.is_set():
+            with contextlib.suppress(Full):
+                results.put(item, timeout=0.1)
+                return
+        raise SyncStopped()
+
+    def _checkpoint(self, db: MusicDB, covers: CoverQueue):
+        """Commits everything written so far. Covers still being saved are
+        waited on first, since their tracks won't be parsed again if the
+        sync is resumed, and would be left without art."""
+        covers.collect(db, block=True)
+        with self.stats.timer('cleanup'):
+            db.remove_orphans()
+        with self.stats.timer('flush'):
+            db.commit()
+        if self._batch:
+            self.emit('batch-committed', self._batch)
+            self._batch = set()
+
+    def _pool(self) -> ProcessPoolExecutor:
+        # GTK's threads don't survive a fork, so the workers are spawned fresh.
+        # (What they run is in scan_worker, so they don't import GTK either.)
+        return ProcessPoolExecutor(
+            max_workers=self._pool_size(),
+            mp_context=multiprocessing.get_context('spawn'),
         )
 
-    def _parse_file(self, file: str, db: MusicDB) -> AudioFile | None:
-        if (mod_time := db.modify_time(file)) and (
-            mod_time >= os.path.getmtime(file)
-        ):
-            return None
-        elif audio := self._parse_audio(file):
-            return audio
+    def _pool_size(self) -> int:
+        return self.workers if self.workers > 0 else os.cpu_count() or 1
 
-    def _pick_cover(self, root: str) -> CoverImage | None:
-        possible_covers = [
-            f'{root}/{file}'
-            for file in os.listdir(root)
-            if file.lower().endswith(('.png', '.jpg', '.jpeg'))
-            and file.lower().startswith(('cover', 'folder'))
-        ]
-        return (
-            CoverImage(open(possible_covers[0], 'rb').read())
-            if possible_covers
-            else None
-        )
+    def _write_directory(
+        self, db: MusicDB, directory: 'WalkedDirectory', covers: CoverQueue
+    ):
+        path, state, scan, cover_file, result = directory
+        if not result:
+            db.update_directory(path, state, scan)
+            return
+        (tracks, embedded, bytes_read), seconds = result
+        self.stats.add_time('parse', seconds)
+        self.stats.count('files_parsed', len(tracks))
+        self.stats.count('bytes_read', bytes_read)
+        with self.stats.timer('write'):
+            db.update_directory(path, state, scan)
+            if not tracks:
+                return
+
+            paths = [track.path for track in tracks]
+            if cover_file and (file_stat := _file_stat(cover_file)):
+                cover_paths = self._cached_cover_file(
+                    db, cover_file, file_stat
+                )
+                if not cover_paths:
+                    covers.add_file(paths, cover_file.path, file_stat)
+            elif embedded:
+                cover_paths = db.cover_paths(embedded.digest)
+                if not cover_paths:
+                    covers.add_image(paths, embedded)
+            else:
+                cover_paths = None
+            if cover_paths:
+                self.stats.count('covers_reused')
+            self._send_to_db(db, tracks, cover_paths)
+
+    def _cached_cover_file(
+        self, db: MusicDB, file: os.DirEntry, stat: FileStat
+    ) -> CoverPaths | None:
+        """Returns the cached paths of an external cover file if it has already
+        been stored and hasn't changed since, in which case it doesn't need to be
+        read or hashed again. (Its hash is looked up by path, size and mtime.)"""
+        if digest := db.cover_file_digest(file.path, stat):
+            return db.cover_paths(digest)
 
-    def _parse_audio(self, file: str) -> AudioFile | None:
-        if (mime := self._mime_type(file)) and not mime.startswith('audio'):
+    def _update_progress(self):
+        # the progress of every root combined
+        visited = sum(walker.visited for walker in self._walkers)
+        discovered = sum(walker.discovered for walker in self._walkers)
+        GLib.idle_add(self.set_property, 'progress', visited / discovered)
+
+    def _changed_stat(
+        self, file: os.DirEntry, known: dict[str, FileStat]
+    ) -> FileStat | None:
+        """Returns the file's stat info if it is an audio file that
+        isn't in the database or has changed since it was parsed."""
+        if not is_audio(file.name) or not (current := _file_stat(file)):
             return None
-        try:
-            audio = mutagen.File(file, easy=True)
-            return AudioFile(audio, file) if audio else None
-        except mutagen.MutagenError:
+        self.stats.count('files_checked')
+        if known.get(file.path) == current:
+            self.stats.count('files_unchanged')
             return None
+        return current
 
-    def _mime_type(self, file: str) -> str | None:
-        return mimetypes.guess_type(file)[0]
+    def _pick_cover(self, files: list[os.DirEntry]) -> os.DirEntry | None:
+        possible_covers = [
+            file
+            for file in files
+            if file.name.lower().endswith(('.png', '.jpg', '.jpeg'))
+            and file.name.lower().startswith(('cover', 'folder'))
+        ]
+        return possible_covers[0] if possible_covers else None
 
     def _send_to_db(
-        self, db: MusicDB, tracks: list[AudioFile], cover: CoverImage | None
+        self,
+        db: MusicDB,
+        tracks: list[TrackTags],
+        cover_paths: CoverPaths | None,
     ):
-        cover = cover or tracks[0].embedded_cover()
-        cover_paths = cover.save() if cover else None
-
-        tags = [t.track_tags(cover_paths) for t in tracks]
-        self._find_albumartist(tags)
+        if cover_paths:
+            thumb, large = cover_paths
+            tracks = [t._replace(thumb=thumb, cover=large) for t in tracks]
+        self._find_albumartist(tracks)
 
-        for track in tags:
-            db.insert_track(track)
+        self._batch |= db.insert_album(tracks)
 
     def _find_albumartist(self, tracks: list[TrackTags]):
         """Finds and sets an albumartist for the given tracks, if possible.
@@ -260,3 +619,29 @@ class MusicParser(GObject.Object):
                 tracks[i].artists.append(
                     ArtistTags('[Various Artists]', 'AAAAAA', tracks[i].path)
                 )
+
+
+def _file_stat(file: os.DirEntry) -> FileStat | None:
+    """Returns the file's modification time and size, or None if it can't be
+    stat'ed. (A dangling symlink, or a file removed since it was listed.)"""
+    try:
+        stat = file.stat()
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _under(path: str, directories: list[str]) -> bool:
+    """Returns whether path is one of directories, or inside one of them."""
+    return any(
+        path == directory or path.startswith(directory + os.sep)
+        for directory in directories
+    )
+
+
+def _device(path: str) -> int | None:
+    """Returns the id of the device path is on, or None if it can't be read."""
+    try:
+        return os.stat(path).st_dev
+    except OSError:
+        return None
@@ -2,6 +2,7 @@ from collections import deque, defaultdict
 import gi
 from gi.repository import Adw, Gtk, GLib, GObject, Gio
 from itertools import chain
+from .covers import CoverStore
 from .items import TrackItem, AlbumItem, QueueItem
 
 gi.require_version('Gtk', '4.0')
@@ -26,6 +27,8 @@ class PlayQueue(Adw.Bin):
 
     jump_to_track = GObject.Signal()
 
+    covers = CoverStore()
+
     def __init__(self):
         super().__init__()
 
@@ -415,7 +418,9 @@ class PlayQueue(Adw.Bin):
             'subtitle',
             GObject.BindingFlags.DEFAULT,
         )
-        queue_row.image_path = obj.thumb
+        queue_row.image_path = self.covers.for_size(
+            obj.thumb, 32, queue_row.get_scale_factor()
+        )
         queue_row.is_album = obj.from_album
         obj.bind_property(
             'is-current',
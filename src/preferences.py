@@ -17,6 +17,9 @@ class RecordBoxPreferencesWindow(Adw.PreferencesWindow):
     restore_window_state = Gtk.Template.Child()
     restore_playback_state = Gtk.Template.Child()
     sync_on_startup = Gtk.Template.Child()
+    scan_workers = Gtk.Template.Child()
+    cover_cache_size = Gtk.Template.Child()
+    watch_for_changes = Gtk.Template.Child()
 
     rg_mode = Gtk.Template.Child()
     rg_enable = Gtk.Template.Child()
@@ -26,6 +29,8 @@ class RecordBoxPreferencesWindow(Adw.PreferencesWindow):
     directory_select_button = Gtk.Template.Child()
     music_directory = GObject.Property(type=str, default='')
 
+    extra_directories = Gtk.Template.Child()
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
 
@@ -40,6 +45,11 @@ class RecordBoxPreferencesWindow(Adw.PreferencesWindow):
         self._rg_mode_in()
 
         self._bind('music-directory', self, 'music-directory')
+        self._extra_rows = []
+        self._extra_directories_in()
+        self.settings.connect(
+            'changed::extra-music-directories', self._extra_directories_in
+        )
 
         self.settings.connect('changed::artist-sort', self._artist_in)
         self.settings.connect('changed::album-sort', self._album_in)
@@ -59,6 +69,9 @@ class RecordBoxPreferencesWindow(Adw.PreferencesWindow):
         )
 
         self._bind('sync-on-startup', self.sync_on_startup, 'active')
+        self._bind('scan-workers', self.scan_workers, 'value')
+        self._bind('cover-cache-size', self.cover_cache_size, 'value')
+        self._bind('watch-library', self.watch_for_changes, 'active')
 
         self._bind('rg-enabled', self.rg_enable, 'enable-expansion')
         self._bind('rg-preamp', self.rg_preamp, 'value')
@@ -97,3 +110,43 @@ class RecordBoxPreferencesWindow(Adw.PreferencesWindow):
         folder: Gio.LocalFile = dialog.select_folder_finish(response)
 
         self.music_directory = folder.get_path()
+
+    def _extra_directories_in(self, *_):
+        for row in self._extra_rows:
+            self.extra_directories.remove(row)
+        self._extra_rows = []
+        for directory in self.settings.get_strv('extra-music-directories'):
+            row = Adw.ActionRow(title=directory)
+            remove = Gtk.Button(
+                icon_name='user-trash-symbolic',
+                valign=Gtk.Align.CENTER,
+                tooltip_text='Remove Directory',
+                css_classes=['flat'],
+            )
+            remove.connect('clicked', self._on_remove_directory, directory)
+            row.add_suffix(remove)
+            self.extra_directories.add_row(row)
+            self._extra_rows.append(row)
+
+    @Gtk.Template.Callback()
+    def _on_add_directory_clicked(self, _):
+        file_chooser = Gtk.FileDialog()
+        file_chooser.set_initial_folder(
+            Gio.File.new_for_path(GLib.get_home_dir())
+        )
+        file_chooser.select_folder(callback=self._on_extra_folder_selected)
+
+    def _on_extra_folder_selected(self, dialog, response):
+        folder: Gio.LocalFile = dialog.select_folder_finish(response)
+        directories = self.settings.get_strv('extra-music-directories')
+        if folder.get_path() not in directories:
+            self.settings.set_strv(
+                'extra-music-directories', directories + [folder.get_path()]
+            )
+
+    def _on_remove_directory(self, _, directory: str):
+        directories = self.settings.get_strv('extra-music-directories')
+        self.settings.set_strv(
+            'extra-music-directories',
+            [d for d in directories if d != directory],
+        )
@@ -0,0 +1,125 @@
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Iterable, Iterator
+import threading
+import time
+
+# What gets counted during a sync. Files in skipped directories aren't stat'ed,
+# so they aren't counted as checked or unchanged.
+COUNTERS = (
+    'directories',
+    'directories_skipped',
+    'files_checked',
+    'files_unchanged',
+    'files_parsed',
+    'covers_decoded',
+    'covers_reused',
+    'rows_written',
+    'bytes_read',
+)
+
+# Where a sync's time goes, in seconds. walk, stat and wait_tags are measured on
+# the walker threads (one per device), parse and decode add up the time the
+# worker processes spent reading tags and saving covers, and the rest are
+# measured on the thread writing to the database.
+PHASES = (
+    'walk',
+    'stat',
+    'wait_tags',
+    'parse',
+    'write',
+    'wait_covers',
+    'decode',
+    'flush',
+    'cleanup',
+    'total',
+)
+
+
+class ScanStats:
+    """Counters and per-phase timers for a sync, stored in the
+    scan_runs table so syncs can be compared with each other. Safe to
+    update from the walker threads, whose times are added together."""
+
+    def __init__(self, root: str = '', full: bool = False):
+        self.root = root
+        self.full = full
+        self.resumed = False
+        self.started = time.time()
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self._lock = threading.Lock()
+
+    def count(self, counter: str, amount: int = 1):
+        with self._lock:
+            self.counters[counter] += amount
+
+    def add_time(self, phase: str, seconds: float):
+        with self._lock:
+            self.phases[phase] += seconds
+
+    @contextmanager
+    def timer(self, phase: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.perf_counter() - start)
+
+    def timed(self, items: Iterable, phase: str) -> Iterator:
+        """Yields from items, adding the time spent getting each one to phase."""
+        items = iter(items)
+        while True:
+            with self.timer(phase):
+                try:
+                    item = next(items)
+                except StopIteration:
+                    return
+            yield item
+
+    def as_row(self) -> dict:
+        return {
+            'root': self.root,
+            'started': self.started,
+            'full': self.full,
+            'resumed': self.resumed,
+            **self.counters,
+            **self.phases,
+        }
+
+
+def format_runs(runs: list[dict]) -> str:
+    """Formats rows from the scan_runs table as a readable report."""
+    if not runs:
+        return 'No syncs recorded.'
+    reports = []
+    for run in runs:
+        started = datetime.fromtimestamp(run['started'])
+        kind = ', '.join(
+            k for k, v in (('full', run['full']), ('resumed', run['resumed'])) if v
+        )
+        reports.append(
+            '\n'.join(
+                [
+                    f"Sync of {run['root']} at {started:%Y-%m-%d %H:%M:%S}"
+                    + (f' ({kind})' if kind else '')
+                    + f": {run['total']:.2f} s",
+                    f"  directories: {run['directories']} walked, "
+                    f"{run['directories_skipped']} skipped",
+                    f"  files: {run['files_checked']} checked, "
+                    f"{run['files_unchanged']} unchanged, "
+                    f"{run['files_parsed']} parsed, "
+                    f"{run['bytes_read'] / 1024 / 1024:.1f} MiB read",
+                    f"  covers: {run['covers_decoded']} decoded, "
+                    f"{run['covers_reused']} reused",
+                    f"  rows written: {run['rows_written']}",
+                    '  seconds: '
+                    + ', '.join(
+                        f'{phase} {run[phase]:.2f}'
+                        for phase in PHASES
+                        if phase != 'total'
+                    ),
+                ]
+            )
+        )
+    return '\n\n'.join(reports)
@@ -0,0 +1,321 @@
+# What runs in the sync's worker processes: reading the tags and embedded
+# covers of audio files, and saving covers to the cover cache. The workers
+# are spawned, so they import this module fresh. It mustn't import gi, or
+# anything that does, (the items and the database do) or every worker would
+# load GTK.
+
+from collections import namedtuple
+from functools import cached_property
+from hashlib import sha256
+from io import BytesIO
+from typing import Any, Callable
+import contextlib
+import io
+import mimetypes
+import mutagen
+from mutagen.easyid3 import EasyID3
+from mutagen.easymp4 import EasyMP4Tags
+from mutagen.id3 import ID3
+from mutagen.mp4 import MP4Tags
+import os
+import time
+from PIL import Image
+from PIL import UnidentifiedImageError
+
+ArtistTags = namedtuple('ArtistTags', ['name', 'sort', 'path'])
+TrackTags = namedtuple(
+    'TrackTags',
+    [
+        'title',
+        'track',
+        'disc',
+        'discsubtitle',
+        'album',
+        'albumartist',
+        'date',
+        'length',
+        'thumb',
+        'cover',
+        'path',
+        'modified',
+        'size',
+        'artists',
+    ],
+)
+
+# The modification time (in nanoseconds) and size of a file on disk,
+# which together are used to tell if a file needs to be parsed again.
+FileStat = tuple[int, int]
+
+# A cover image in the cover cache: its hash, the dimensions of its largest
+# cached version, the total size of its cached files on disk in bytes, and
+# the paths that get stored as a track's thumb and cover.
+CachedCover = namedtuple(
+    'CachedCover', ['digest', 'width', 'height', 'disk_size', 'thumb', 'cover']
+)
+
+CoverPaths = tuple[str, str]
+
+# Cached covers are saved as JPEGs, which are much smaller
+# and faster to decode than PNGs at these sizes.
+COVER_FORMAT = 'JPEG'
+COVER_EXTENSION = 'jpg'
+COVER_QUALITY = 90
+
+
+class CoverImage:
+    """A class that represents a cover image for an album,
+    with methods for scaling it down to the sizes that get
+    cached. Must be provided with the image data as a bytes object
+    on init. The image's hash is only computed once, the first
+    time it is needed."""
+
+    def __init__(self, image: bytes):
+        self.image = image
+
+    @cached_property
+    def digest(self) -> str:
+        return sha256(self.image).hexdigest()
+
+    def resize(self, sizes: list[int]) -> list[Image.Image] | None:
+        """Returns the image scaled down to fit each of the given sizes,
+        decoding it only once. JPEGs are decoded straight at the smallest
+        scale that still covers the largest size, rather than at full
+        resolution. Returns None if the image can't be read."""
+        try:
+            image = Image.open(BytesIO(self.image))
+            image.draft('RGB', (max(sizes), max(sizes)))
+            image = image.convert('RGB')
+        except (UnidentifiedImageError, OSError):
+            return None
+        # each size is scaled down from the one above it
+        resized = {}
+        for size in sorted(set(sizes), reverse=True):
+            image = image.copy()
+            image.thumbnail((size, size))
+            resized[size] = image
+        return [resized[size] for size in sizes]
+
+
+# The tags of every audio file in a directory that needed parsing, along with
+# the embedded cover of the first one and the number of bytes read from the
+# files, as returned by read_directory.
+DirectoryTags = tuple[list[TrackTags], CoverImage | None, int]
+
+
+class CountingFileIO(io.FileIO):
+    """A file that counts how many bytes are read from it, for measuring
+    how much of each file mutagen has to read to get its tags."""
+
+    bytes_read = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = super().read(size)
+        self.bytes_read += len(data or b'')
+        return data
+
+    def readall(self) -> bytes:
+        data = super().readall()
+        self.bytes_read += len(data)
+        return data
+
+    def readinto(self, buffer) -> int | None:
+        read = super().readinto(buffer)
+        self.bytes_read += read or 0
+        return read
+
+
+class EasyTags:
+    """mutagen's easy interface to ID3 and MP4 tags, built over tags that were
+    already loaded instead of reading them from the file a second time. (The same
+    key getters mutagen's EasyID3 and EasyMP4Tags classes use are looked up here.)"""
+
+    def __init__(self, tags, getters: dict):
+        self.tags = tags
+        self.getters = getters
+
+    def __getitem__(self, key: str) -> list[str]:
+        # raises KeyError for unknown keys as well as missing frames
+        return self.getters[key](self.tags, key)
+
+    def __contains__(self, key: str) -> bool:
+        try:
+            self[key]
+            return True
+        except KeyError:
+            return False
+
+
+class AudioFile:
+    """A wrapper around mutagen's File class that provides an interface
+    for extracting metadata from audio files in a format more suitable
+    for inserting into RecordBox's database. The file is only opened
+    once: the tags, stream info and embedded pictures all come from
+    the same mutagen object."""
+
+    def __init__(self, audio, file: str):
+        self.audio = audio
+        self.file = file
+        self.bytes_read = 0
+        match audio.tags:
+            case ID3():
+                self.tags = EasyTags(audio.tags, EasyID3.Get)
+            case MP4Tags():
+                self.tags = EasyTags(audio.tags, EasyMP4Tags.Get)
+            case None:
+                self.tags = {}
+            case _:
+                self.tags = audio.tags
+
+    @classmethod
+    def open(cls, file: str) -> 'AudioFile | None':
+        """Opens the given file with mutagen, returning None if
+        it isn't an audio file mutagen can read tags from."""
+        if not is_audio(file):
+            return None
+        try:
+            with CountingFileIO(file) as raw, io.BufferedReader(raw) as f:
+                audio = mutagen.File(f)
+        except (mutagen.MutagenError, OSError):
+            return None
+        if not audio:
+            return None
+        audio_file = cls(audio, file)
+        audio_file.bytes_read = raw.bytes_read
+        return audio_file
+
+    def try_key(self, key: str) -> str | None:
+        """Attempts to get a key from the audio file.
+        Args:
+            key: The key to get from the audio file.
+        """
+
+        return self.tags[key][0] if key in self.tags else None
+
+    def try_key_all(self, key: str) -> list[str]:
+        return self.tags[key] if key in self.tags else []
+
+    def artists(self) -> list[ArtistTags]:
+        """Returns a list of the artists associated with the audio file."""
+        return [
+            ArtistTags(str(artist), self.try_key('artistsort'), self.file)
+            for artist in self.try_key_all('artist')
+        ]
+
+    def track_tags(
+        self, stat: FileStat, cover_paths: CoverPaths | None = None
+    ) -> TrackTags:
+        """Returns the track information from the audio file.
+        Args:
+            stat: The modification time and size the file was read with.
+            cover_paths: The paths of the album's cached cover images.
+        """
+        thumb, cover = cover_paths or (None, None)
+        return TrackTags(
+            self.try_key('title') or 'Unknown Title',
+            self.try_key('tracknumber') or '0',
+            self.try_key('discnumber'),
+            self.try_key('discsubtitle'),
+            self.try_key('album') or 'Unknown Album',
+            self.try_key('albumartist'),
+            self.try_key('date'),
+            self.audio.info.length,
+            thumb,
+            cover,
+            self.file,
+            *stat,
+            self.artists(),
+        )
+
+    def embedded_cover(self) -> CoverImage | None:
+        """Extracts the embedded cover image from the audio file,
+        if it exists. Otherwise, returns None."""
+        match self.audio.tags:
+            case MP4Tags() if covers := self.audio.tags.get('covr'):
+                return CoverImage(bytes(covers[0]))
+            case ID3() if frames := self.audio.tags.getall('APIC'):
+                return CoverImage(frames[0].data)
+        with contextlib.suppress(AttributeError, IndexError):
+            return CoverImage(self.audio.pictures[0].data)
+
+
+def is_audio(file: str) -> bool:
+    """Guesses from the file's extension if it could be an audio file.
+    (Files with unknown extensions are given to mutagen to decide.)"""
+    mime = mimetypes.guess_type(file)[0]
+    return not mime or mime.startswith('audio')
+
+
+def read_directory(
+    files: dict[str, FileStat], with_cover: bool = True
+) -> DirectoryTags:
+    """Reads the tags of the given files, which should all be from the same
+    directory. Runs in the parser's worker processes, so everything returned
+    has to be picklable.
+    Args:
+        files: The files in the directory that need to be parsed, mapped
+            to the stat info they were found with.
+        with_cover: Whether to extract the embedded cover of the first track.
+    """
+    audio = [a for file in files if (a := AudioFile.open(file))]
+    cover = audio[0].embedded_cover() if audio and with_cover else None
+    return (
+        [a.track_tags(files[a.file]) for a in audio],
+        cover,
+        sum(a.bytes_read for a in audio),
+    )
+
+
+def timed(function: Callable, *args) -> tuple[Any, float]:
+    """Calls function with args, returning its result along with how many
+    seconds it took. Used to measure the time spent in worker processes."""
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def cover_path(root: str, digest: str, size: int) -> str:
+    """Returns the path of a cover's version at size, in the cache at root."""
+    return f'{root}/covers/{size}/{digest}.{COVER_EXTENSION}'
+
+
+def save_cover(
+    cover: CoverImage, root: str, sizes: list[int]
+) -> CachedCover | None:
+    """Saves every size of the cover to the cover cache at root, returning
+    what the database needs to record it. Returns None if the image couldn't
+    be read. (Whether the cover is already cached is up to the caller to
+    check, since that's recorded in the database.)
+    Args:
+        cover: The image to save.
+        root: The directory the cover cache is in.
+        sizes: The sizes the cover is cached at, smallest first.
+    """
+    if not (images := cover.resize(sizes)):
+        return None
+    disk_size = 0
+    for size, image in zip(sizes, images):
+        path = cover_path(root, cover.digest, size)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        image.save(path, COVER_FORMAT, quality=COVER_QUALITY)
+        disk_size += os.path.getsize(path)
+    return CachedCover(
+        cover.digest,
+        *images[-1].size,
+        disk_size,
+        cover_path(root, cover.digest, sizes[0]),
+        cover_path(root, cover.digest, sizes[-1]),
+    )
+
+
+def save_cover_file(
+    path: str, root: str, sizes: list[int]
+) -> CachedCover | None:
+    """Reads an image file and saves it like save_cover does. Returns None
+    if the file can't be read, like images that can't be decoded."""
+    try:
+        with open(path, 'rb') as f:
+            image = f.read()
+    except OSError:
+        return None
+    return save_cover(CoverImage(image), root, sizes)
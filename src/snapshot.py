@@ -0,0 +1,82 @@
+from gi.repository import GLib
+import os
+import pickle
+
+from .items import AlbumItem, ArtistItem
+from .musicdb import MusicDB
+
+# Bumped whenever what's stored in a snapshot changes, so older ones are ignored.
+SNAPSHOT_VERSION = 2
+
+SNAPSHOT_PATH = f'{GLib.get_user_cache_dir()}/RecordBox/library.snapshot'
+
+# What gets stored of each album. (Their tracks aren't, since albums load
+# them when they're needed.)
+ALBUM_FIELDS = (
+    'id',
+    'title',
+    'albumartist',
+    'date',
+    'length',
+    'num_tracks',
+    'thumb',
+    'cover',
+    'artists',
+)
+
+Lists = tuple[list[ArtistItem], list[AlbumItem]]
+
+
+def load_library(db: MusicDB, all_artists: bool = False) -> Lists:
+    """Returns the artists and albums for the library's lists, from the snapshot
+    if the library hasn't changed since it was saved. Otherwise they're loaded
+    from the database, and saved as the new snapshot."""
+    # Read first, so the snapshot can only be tagged with a generation older
+    # than what it holds, (if a sync commits in between) which just means it
+    # gets loaded from the database again next time.
+    generation = db.generation()
+    if lists := load_snapshot(generation, all_artists):
+        return lists
+    artists, albums = db.get_artists(all_artists), db.get_albums()
+    save_snapshot(generation, all_artists, artists, albums)
+    return artists, albums
+
+
+def save_snapshot(
+    generation: int,
+    all_artists: bool,
+    artists: list[ArtistItem],
+    albums: list[AlbumItem],
+    path: str = SNAPSHOT_PATH,
+):
+    """Saves the lists as plain tuples, tagged with the database generation
+    they were loaded at. (Written to a temporary file first, so a snapshot
+    is never left half written.)"""
+    data = (
+        SNAPSHOT_VERSION,
+        generation,
+        all_artists,
+        [(a.raw_name, a.sort, a.num_albums) for a in artists],
+        [tuple(getattr(album, f) for f in ALBUM_FIELDS) for album in albums],
+    )
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f'{path}.tmp', 'wb') as f:
+        pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+    os.replace(f'{path}.tmp', path)
+
+
+def load_snapshot(
+    generation: int, all_artists: bool, path: str = SNAPSHOT_PATH
+) -> Lists | None:
+    """Returns the lists saved in the snapshot, or None if there isn't one,
+    it can't be read, or it wasn't saved at the given generation."""
+    try:
+        with open(path, 'rb') as f:
+            version, saved, saved_all, artists, albums = pickle.load(f)
+    except (OSError, EOFError, ValueError, TypeError, pickle.UnpicklingError):
+        return None
+    if (version, saved, saved_all) != (SNAPSHOT_VERSION, generation, all_artists):
+        return None
+    return [ArtistItem(*artist) for artist in artists], [
+        AlbumItem(**dict(zip(ALBUM_FIELDS, album))) for album in albums
+    ]
@@ -0,0 +1,71 @@
+from collections import OrderedDict
+import threading
+
+from .items import TrackItem, sort_key
+
+# How many albums' tracks are kept. Albums average around a dozen tracks,
+# so this is enough for the albums around the selection and some history
+# without holding on to much of the library.
+TRACK_CACHE_SIZE = 64
+
+# How many albums either side of the selected one are prefetched.
+PREFETCH_DISTANCE = 5
+
+
+class TrackCache:
+    """Holds the tracks of the albums used most recently, keyed by album id.
+    Albums are listed without their tracks, and the library loads them into
+    here, through the database service, when they're needed. The cache never
+    loads anything itself, so looking an album up never waits on the
+    database.
+
+    Tracks are stored from the database service's thread, so the cache is
+    locked while it's used."""
+
+    def __init__(self, size: int = TRACK_CACHE_SIZE):
+        self._size = size
+        self._albums: OrderedDict[int, list[TrackItem]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, album: int) -> list[TrackItem] | None:
+        """Returns the album's tracks, or None if they aren't cached."""
+        with self._lock:
+            if (tracks := self._albums.get(album)) is not None:
+                self._albums.move_to_end(album)
+            return tracks
+
+    def touch(self, albums: list[int]) -> set[int]:
+        """Counts the given albums that are cached as just used, in the order
+        given, and returns the ids of those that aren't cached."""
+        with self._lock:
+            for album in albums:
+                if album in self._albums:
+                    self._albums.move_to_end(album)
+            return {album for album in albums if album not in self._albums}
+
+    def add(
+        self, loaded: dict[int, list[TrackItem]], albums: list[int]
+    ) -> dict[int, list[TrackItem]]:
+        """Caches the tracks loaded for the albums with the given ids, and
+        returns them in order. They're counted as used in the order given, so
+        the first ones are the first to be dropped. Albums without tracks,
+        (removed since they were listed) aren't cached."""
+        added = {}
+        with self._lock:
+            for album in albums:
+                if tracks := sorted(loaded.get(album, []), key=sort_key):
+                    self._albums[album] = added[album] = tracks
+                    self._albums.move_to_end(album)
+            while len(self._albums) > self._size:
+                self._albums.popitem(last=False)
+        return added
+
+    def discard(self, albums: set[int]):
+        """Drops the given albums, after their tracks have changed."""
+        with self._lock:
+            for album in albums:
+                self._albums.pop(album, None)
+
+    def clear(self):
+        with self._lock:
+            self._albums.clear()
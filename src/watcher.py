@@ -0,0 +1,126 @@
+from gi.repository import GLib, GObject, Gio
+import os
+import threading
+
+
+class LibraryWatcher(GObject.Object):
+    """Watches a directory tree for changes using a Gio.FileMonitor on every
+    directory in it, (inotify can't watch a tree recursively) and reports which
+    directories changed. Events are collected until none have arrived for a
+    short delay, so that something like a ripper writing out an album is
+    reported as one change instead of one per file."""
+
+    __gtype_name__ = 'RecordBoxLibraryWatcher'
+
+    # Emits with the list of directories that need to be synced again.
+    changed = GObject.Signal(arg_types=(GObject.TYPE_PYOBJECT,))
+
+    # Seconds to wait after the last event before emitting changed.
+    delay = GObject.Property(type=int, default=3)
+
+    def __init__(self):
+        super().__init__()
+        self._monitors: dict[str, Gio.FileMonitor] = {}
+        self._pending: set[str] = set()
+        self._timeout = None
+        self._paths = None
+
+    def start(self, paths: list[str]):
+        """Starts watching each of paths and every directory under them. The
+        trees are listed on a separate thread, so this returns immediately."""
+        if paths == self._paths:
+            return
+        self.stop()
+        self._paths = paths
+        threading.Thread(
+            target=self._find_directories, args=(paths,), daemon=True
+        ).start()
+
+    def stop(self):
+        for monitor in self._monitors.values():
+            monitor.cancel()
+        self._monitors.clear()
+        self._pending.clear()
+        if self._timeout:
+            GLib.source_remove(self._timeout)
+            self._timeout = None
+        self._paths = None
+
+    def _find_directories(self, paths: list[str]):
+        directories = [root for path in paths for root, _, _ in os.walk(path)]
+        GLib.idle_add(self._watch_all, paths, directories)
+
+    def _watch_all(self, paths: list[str], directories: list[str]):
+        # the watcher may have been stopped or moved while the trees were listed
+        if paths == self._paths:
+            for directory in directories:
+                self._watch(directory)
+
+    def _watch(self, path: str):
+        if path in self._monitors:
+            return
+        try:
+            monitor = Gio.File.new_for_path(path).monitor_directory(
+                Gio.FileMonitorFlags.WATCH_MOVES, None
+            )
+        except GLib.Error:
+            return
+        monitor.connect('changed', self._on_changed)
+        self._monitors[path] = monitor
+
+    def _unwatch(self, path: str):
+        for directory in [
+            d
+            for d in self._monitors
+            if d == path or d.startswith(f'{path}/')
+        ]:
+            self._monitors.pop(directory).cancel()
+
+    def _on_changed(self, _, file: Gio.File, other: Gio.File | None, event):
+        path = file.get_path()
+        match event:
+            case Gio.FileMonitorEvent.CREATED | Gio.FileMonitorEvent.MOVED_IN:
+                if os.path.isdir(path):
+                    # New directories get synced (and watched) as a whole.
+                    for root, _, _ in os.walk(path):
+                        self._watch(root)
+                    self._queue(path)
+                else:
+                    self._queue(os.path.dirname(path))
+            case Gio.FileMonitorEvent.DELETED | Gio.FileMonitorEvent.MOVED_OUT:
+                if path in self._monitors:
+                    self._unwatch(path)
+                    self._queue(path)
+                else:
+                    self._queue(os.path.dirname(path))
+            case Gio.FileMonitorEvent.RENAMED:
+                if path in self._monitors:
+                    self._unwatch(path)
+                    self._queue(path)
+                    for root, _, _ in os.walk(other.get_path()):
+                        self._watch(root)
+                    self._queue(other.get_path())
+                else:
+                    self._queue(os.path.dirname(path))
+            case Gio.FileMonitorEvent.CHANGES_DONE_HINT:
+                self._queue(os.path.dirname(path))
+
+    def _queue(self, directory: str):
+        self._pending.add(directory)
+        if self._timeout:
+            GLib.source_remove(self._timeout)
+        self._timeout = GLib.timeout_add_seconds(self.delay, self._flush)
+
+    def _flush(self):
+        self._timeout = None
+        # Directories under another pending directory get synced along with
+        # it, so only the topmost ones are reported.
+        pending = sorted(self._pending)
+        self._pending.clear()
+        roots = [
+            path
+            for i, path in enumerate(pending)
+            if not any(path.startswith(f'{p}/') for p in pending[:i])
+        ]
+        self.emit('changed', roots)
+        return False
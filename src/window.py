@@ -73,6 +73,13 @@ class RecordBoxWindow(Adw.ApplicationWindow):
             self._bind('is-fullscreen', self, 'fullscreened')
 
         self._bind('music-directory', self.library, 'music_directory')
+        self._bind(
+            'extra-music-directories', self.library, 'extra_directories'
+        )
+        self._bind('scan-workers', self.library, 'scan_workers')
+        self._bind('scan-batch-size', self.library, 'scan_batch_size')
+        self._bind('cover-cache-size', self.library, 'cover_cache_size')
+        self._bind('watch-library', self.library, 'watch_library')
         self._set('artist-sort', self.library, 'artist-sort')
         self._set('album-sort', self.library, 'album-sort')
         self._bind('show-all-artists', self.library, 'show_all_artists')
@@ -178,12 +185,17 @@ class RecordBoxWindow(Adw.ApplicationWindow):
             album = self._album_to_disc(album, d)
         self._add_album_to_queue(album, overwrite=True)
 
-    def return_to_playing(self, *_):
-        if current_track := self.player.current_track:
-            album = self.library.find_album_by_track(current_track)
-            self.library.select_album(current_track.albumartist, album)
-            if self.album_overview.current_album != album:
-                self._update_album(album)
+    def return_to_playing(self, *_) -> AlbumItem | None:
+        """Selects and shows the album of the current track, returning it.
+        (None if there isn't a current track, or its album isn't listed.)"""
+        if not (current_track := self.player.current_track):
+            return None
+        if not (album := self.library.find_album_by_track(current_track)):
+            return None
+        self.library.select_album(current_track.albumartist, album)
+        if self.album_overview.current_album != album:
+            self.library.load_album(album, self._update_album)
+        return album
 
     def save_state(self):
         data = self.play_queue.export()
@@ -210,15 +222,19 @@ class RecordBoxWindow(Adw.ApplicationWindow):
             self.play_queue.import_state(state_data)
             self.player.resume(state_data['current']['position'])
 
-        self.return_to_playing()
-        if current_album := self.album_overview.current_album:
+        # the lists are filled in the background, so the current track's
+        # album can't be found until they have been
+        self.library.when_loaded(self._return_to_restored)
+
+    def _return_to_restored(self):
+        if album := self.return_to_playing():
             # the selected items in the lists get cleared for some reason while
             # the window is opening, so we need to reselect them after a delay
             GLib.timeout_add(
                 300,
                 self.library.select_album,
-                current_album.albumartist,
-                current_album,
+                album.albumartist,
+                album,
             )
 
     ## UI Callbacks ##